@@ -0,0 +1,355 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+import redis
+
+import config
+from redis_client import get_redis
+
+# Redis keys. Reservations live in sorted sets scored by admission time, so queue
+# depth is a ZCARD and reservations that were never released can be expired by age.
+# Deferred (low-priority) reservations are kept in their own sets, so they never count
+# toward the interactive depth, its hard limit or its wait estimate.
+# Every update runs as one Lua script, so a failure can never leave the sets and
+# the byte counters out of step.
+_RESERVATIONS_KEY = "roboseg:admission:reservations"
+_DEFERRED_KEY = "roboseg:admission:deferred"
+_TASK_CLIENTS_KEY = "roboseg:admission:task_clients"
+_TASK_BYTES_KEY = "roboseg:admission:task_bytes"
+_GLOBAL_BYTES_KEY = "roboseg:admission:reserved_bytes"
+# Per-client keys are "<prefix><client_id>:reservations", "<prefix><client_id>:deferred"
+# and "<prefix><client_id>:reserved_bytes"
+_CLIENT_KEY_PREFIX = "roboseg:admission:client:"
+_SECONDS_PER_JOB_KEY = "roboseg:admission:seconds_per_job"
+# "<timestamp>:<tasks still queued>" of the most recent completion
+_LAST_COMPLETION_KEY = "roboseg:admission:last_completion"
+_SCRIPT_KEYS = [_RESERVATIONS_KEY, _TASK_CLIENTS_KEY, _TASK_BYTES_KEY, _GLOBAL_BYTES_KEY, _DEFERRED_KEY]
+
+# Weight of the newest observation in the throughput moving average
+_THROUGHPUT_SMOOTHING = 0.2
+# Upper bound on a single throughput observation, so one outlier cannot dominate the estimate
+_MAX_COMPLETION_INTERVAL_SECONDS = 3600
+
+# Shared by the scripts below. ARGV[1] is always _CLIENT_KEY_PREFIX.
+_LUA_HELPERS = """
+local function drop(task_id)
+    if redis.call('ZREM', KEYS[1], task_id) + redis.call('ZREM', KEYS[5], task_id) == 0 then
+        return false
+    end
+    local client_id = redis.call('HGET', KEYS[2], task_id)
+    local size = tonumber(redis.call('HGET', KEYS[3], task_id) or '0')
+    redis.call('HDEL', KEYS[2], task_id)
+    redis.call('HDEL', KEYS[3], task_id)
+    redis.call('DECRBY', KEYS[4], size)
+    if client_id then
+        redis.call('ZREM', ARGV[1] .. client_id .. ':reservations', task_id)
+        redis.call('ZREM', ARGV[1] .. client_id .. ':deferred', task_id)
+        redis.call('DECRBY', ARGV[1] .. client_id .. ':reserved_bytes', size)
+    end
+    return true
+end
+
+local function purge_expired(cutoff)
+    local count = 0
+    for _, key in ipairs({KEYS[1], KEYS[5]}) do
+        local expired = redis.call('ZRANGEBYSCORE', key, '-inf', cutoff)
+        for _, task_id in ipairs(expired) do
+            drop(task_id)
+        end
+        count = count + #expired
+    end
+    return count
+end
+"""
+
+# Reserves in the interactive lane; _DEFER_SCRIPT moves the reservation if the task is deferred.
+# ARGV: prefix, cutoff, task_id, client_id, size_bytes, now
+# Returns depth, reserved bytes, client depth, client reserved bytes (after reserving), expired count
+# and deferred depth. Depths are of the interactive lane; bytes cover both lanes.
+_RESERVE_SCRIPT = _LUA_HELPERS + """
+local expired = purge_expired(ARGV[2])
+local task_id, client_id, size, now = ARGV[3], ARGV[4], tonumber(ARGV[5]), ARGV[6]
+local client_reservations = ARGV[1] .. client_id .. ':reservations'
+redis.call('ZADD', KEYS[1], now, task_id)
+redis.call('HSET', KEYS[2], task_id, client_id)
+redis.call('HSET', KEYS[3], task_id, size)
+redis.call('ZADD', client_reservations, now, task_id)
+return {
+    redis.call('ZCARD', KEYS[1]),
+    redis.call('INCRBY', KEYS[4], size),
+    redis.call('ZCARD', client_reservations),
+    redis.call('INCRBY', ARGV[1] .. client_id .. ':reserved_bytes', size),
+    expired,
+    redis.call('ZCARD', KEYS[5])
+}
+"""
+
+# ARGV: prefix, task_id
+# Returns the deferred depth after moving the task's reservation to the low-priority lane,
+# or -1 if the task no longer holds an interactive reservation
+_DEFER_SCRIPT = """
+local admitted_at = redis.call('ZSCORE', KEYS[1], ARGV[2])
+if not admitted_at then
+    return -1
+end
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('ZADD', KEYS[5], admitted_at, ARGV[2])
+local client_id = redis.call('HGET', KEYS[2], ARGV[2])
+if client_id then
+    redis.call('ZREM', ARGV[1] .. client_id .. ':reservations', ARGV[2])
+    redis.call('ZADD', ARGV[1] .. client_id .. ':deferred', admitted_at, ARGV[2])
+end
+return redis.call('ZCARD', KEYS[5])
+"""
+
+# ARGV: prefix, task_id
+# Returns the tasks left in both lanes after releasing, or -1 if the task held no reservation
+_RELEASE_SCRIPT = _LUA_HELPERS + """
+if not drop(ARGV[2]) then
+    return -1
+end
+return redis.call('ZCARD', KEYS[1]) + redis.call('ZCARD', KEYS[5])
+"""
+
+# ARGV: prefix, task_id, size_bytes
+# Returns 1 if the task still held a reservation that was grown, else 0
+_ADD_BYTES_SCRIPT = """
+local client_id = redis.call('HGET', KEYS[2], ARGV[2])
+if not client_id or not (redis.call('ZSCORE', KEYS[1], ARGV[2]) or redis.call('ZSCORE', KEYS[5], ARGV[2])) then
+    return 0
+end
+redis.call('HINCRBY', KEYS[3], ARGV[2], ARGV[3])
+redis.call('INCRBY', KEYS[4], ARGV[3])
+redis.call('INCRBY', ARGV[1] .. client_id .. ':reserved_bytes', ARGV[3])
+return 1
+"""
+
+# ARGV: prefix, cutoff
+# Returns depth, reserved bytes, expired count, deferred depth
+_PURGE_SCRIPT = _LUA_HELPERS + """
+local expired = purge_expired(ARGV[2])
+return {
+    redis.call('ZCARD', KEYS[1]),
+    tonumber(redis.call('GET', KEYS[4]) or '0'),
+    expired,
+    redis.call('ZCARD', KEYS[5])
+}
+"""
+
+
+@dataclass
+class AdmissionDecision:
+    """Outcome of an admission check for a single submission."""
+    admitted: bool
+    priority: int = 0
+    estimated_wait_seconds: float = 0.0
+    retry_after_seconds: int = 0
+    reason: Optional[str] = None
+
+    @property
+    def deferred(self) -> bool:
+        return self.admitted and self.priority != 0
+
+
+def client_id_for(headers: Dict[str, str], remote_host: Optional[str]) -> str:
+    """
+    Identify the submitting client by the X-Client-Id header, falling back to its address.
+
+    The header is self-declared and not authenticated: a caller can rotate it to dodge
+    per-client limits or claim an id with larger limits. Only trust it behind a gateway
+    that sets it, or turn it off with ADMISSION_TRUST_CLIENT_ID_HEADER=False.
+    """
+    client_id = headers.get("x-client-id") if config.ADMISSION_TRUST_CLIENT_ID_HEADER else None
+    return client_id or remote_host or "anonymous"
+
+
+def client_limits(client_id: str) -> Dict[str, Any]:
+    """Return the effective limits for a client: the defaults overlaid with its overrides."""
+    limits = dict(config.ADMISSION_DEFAULT_CLIENT_LIMITS)
+    limits.update(config.ADMISSION_CLIENT_LIMITS.get(client_id, {}))
+    return limits
+
+
+def _seconds_per_job(raw: Optional[bytes]) -> float:
+    if raw:
+        return float(raw)
+    return config.ADMISSION_DEFAULT_JOB_SECONDS / max(config.WORKER_CONCURRENCY, 1)
+
+
+def admit(task_id: str, client_id: str, size_bytes: int = 0) -> AdmissionDecision:
+    """
+    Reserve capacity for a new task, or refuse it.
+
+    The reservation is taken optimistically and given back when a limit is exceeded,
+    so concurrent API processes can never overshoot the limits. Reservations older
+    than ADMISSION_RESERVATION_TTL_SECONDS are dropped first, so tasks whose release
+    was lost (a dead chain, a lost worker) stop counting against the limits.
+    Global limits always reject; per-client limits reject or defer into the
+    low-priority lane depending on the client's "overflow" setting. Deferred tasks
+    are only limited by ADMISSION_MAX_DEFERRED_DEPTH and the global byte limit, and
+    do not count toward the interactive depth or wait estimate.
+    If Redis is unreachable the submission is admitted (fail open).
+    """
+    if not config.ADMISSION_ENABLED:
+        return AdmissionDecision(admitted=True)
+
+    limits = client_limits(client_id)
+
+    try:
+        r = get_redis(config.ADMISSION_REDIS_URL)
+        depth, inflight_bytes, client_depth, client_bytes, expired, deferred_depth = r.register_script(_RESERVE_SCRIPT)(
+            keys=_SCRIPT_KEYS,
+            args=[_CLIENT_KEY_PREFIX, _expiry_cutoff(), task_id, client_id, size_bytes, time.time()]
+        )
+        raw_seconds_per_job = r.get(_SECONDS_PER_JOB_KEY)
+    except redis.RedisError as e:
+        print(f"Warning: admission control unavailable, admitting task {task_id}: {str(e)}")
+        return AdmissionDecision(admitted=True)
+    if expired:
+        print(f"Warning: dropped {expired} admission reservations that were never released")
+
+    seconds_per_job = _seconds_per_job(raw_seconds_per_job)
+    estimated_wait = (depth - 1) * seconds_per_job
+
+    reason = None
+    hard_limit = False
+    if inflight_bytes > config.ADMISSION_MAX_INFLIGHT_BYTES:
+        reason, hard_limit = "in-flight upload size limit reached", True
+    elif client_depth > limits["max_queued"]:
+        reason = f"client queue limit reached ({limits['max_queued']} tasks)"
+    elif client_bytes > limits["max_inflight_bytes"]:
+        reason = "client in-flight upload size limit reached"
+    elif estimated_wait > limits["max_wait_seconds"]:
+        reason = f"estimated wait of {int(estimated_wait)}s exceeds {int(limits['max_wait_seconds'])}s"
+    # A task bound for the low-priority lane never takes an interactive slot
+    if depth > config.ADMISSION_MAX_QUEUE_DEPTH and (reason is None or limits["overflow"] != "defer"):
+        reason, hard_limit = f"queue depth limit reached ({config.ADMISSION_MAX_QUEUE_DEPTH} tasks)", True
+
+    if reason is not None and not hard_limit and limits["overflow"] == "defer":
+        try:
+            deferred_depth = r.register_script(_DEFER_SCRIPT)(keys=_SCRIPT_KEYS, args=[_CLIENT_KEY_PREFIX, task_id])
+        except redis.RedisError as e:
+            print(f"Warning: failed to move task {task_id} to the low-priority lane: {str(e)}")
+        if deferred_depth <= config.ADMISSION_MAX_DEFERRED_DEPTH:
+            print(f"Deferring task {task_id} for client {client_id} to low-priority lane: {reason}")
+            return AdmissionDecision(
+                admitted=True,
+                priority=config.ADMISSION_LOW_PRIORITY,
+                # Behind everything else in both lanes
+                estimated_wait_seconds=(depth - 1 + max(deferred_depth - 1, 0)) * seconds_per_job,
+                reason=reason,
+            )
+        reason, hard_limit = f"low-priority queue limit reached ({config.ADMISSION_MAX_DEFERRED_DEPTH} tasks)", True
+
+    if reason is not None:
+        cancel(task_id)
+        if estimated_wait > limits["max_wait_seconds"] and not hard_limit:
+            retry_after = estimated_wait - limits["max_wait_seconds"]
+        else:
+            retry_after = seconds_per_job
+        return AdmissionDecision(
+            admitted=False,
+            estimated_wait_seconds=estimated_wait,
+            retry_after_seconds=max(1, int(math.ceil(retry_after))),
+            reason=reason,
+        )
+
+    return AdmissionDecision(admitted=True, estimated_wait_seconds=estimated_wait)
+
+
+def _expiry_cutoff() -> float:
+    return time.time() - config.ADMISSION_RESERVATION_TTL_SECONDS
+
+
+def _drop(task_id: str) -> int:
+    """Give back a task's reservation. Returns the depth left, or -1 if the task held none."""
+    return get_redis(config.ADMISSION_REDIS_URL).register_script(_RELEASE_SCRIPT)(
+        keys=_SCRIPT_KEYS,
+        args=[_CLIENT_KEY_PREFIX, task_id]
+    )
+
+
+def add_bytes(task_id: str, size_bytes: int) -> None:
+    """
+    Grow a task's reservation by data it brought in after admission, such as a video
+    downloaded from a URL. The bytes are given back with the rest of the reservation.
+    """
+    if not config.ADMISSION_ENABLED or size_bytes <= 0:
+        return
+    try:
+        get_redis(config.ADMISSION_REDIS_URL).register_script(_ADD_BYTES_SCRIPT)(
+            keys=_SCRIPT_KEYS,
+            args=[_CLIENT_KEY_PREFIX, task_id, size_bytes]
+        )
+    except redis.RedisError as e:
+        print(f"Warning: failed to add {size_bytes} bytes to the admission reservation of task {task_id}: {str(e)}")
+
+
+def cancel(task_id: str) -> None:
+    """
+    Give back the reservation of a task that was never queued.
+
+    Unlike release() this is not a completion, so it does not touch the throughput estimate.
+    """
+    if not config.ADMISSION_ENABLED:
+        return
+    try:
+        _drop(task_id)
+    except redis.RedisError as e:
+        print(f"Warning: failed to roll back admission reservation for task {task_id}: {str(e)}")
+
+
+def release(task_id: str) -> None:
+    """
+    Return a task's reservation and feed its completion into the throughput estimate.
+
+    Safe to call more than once; only the first call for a task has any effect.
+    """
+    if not config.ADMISSION_ENABLED:
+        return
+
+    try:
+        remaining_depth = _drop(task_id)
+        if remaining_depth < 0:
+            return
+
+        r = get_redis(config.ADMISSION_REDIS_URL)
+        now = time.time()
+        raw_seconds_per_job = r.get(_SECONDS_PER_JOB_KEY)
+        last_completion = r.getset(_LAST_COMPLETION_KEY, f"{now}:{remaining_depth}")
+
+        # The time since the previous completion measures throughput only if the system
+        # was busy for all of it, i.e. work was still queued when that completion happened.
+        # Otherwise the interval includes idle time and would inflate the estimate.
+        last_completion_at, queued_then = (last_completion or b"0:0").decode().split(":")
+        if int(queued_then) > 0:
+            interval = min(now - float(last_completion_at), _MAX_COMPLETION_INTERVAL_SECONDS)
+            previous = _seconds_per_job(raw_seconds_per_job)
+            smoothed = (1 - _THROUGHPUT_SMOOTHING) * previous + _THROUGHPUT_SMOOTHING * interval
+            # Read-modify-write is not atomic; a lost update only nudges an estimate.
+            r.set(_SECONDS_PER_JOB_KEY, smoothed)
+    except redis.RedisError as e:
+        print(f"Warning: failed to release admission for task {task_id}: {str(e)}")
+
+
+def snapshot() -> Dict[str, Any]:
+    """Return the current global counters and throughput estimate."""
+    r = get_redis(config.ADMISSION_REDIS_URL)
+    depth, inflight_bytes, _, deferred_depth = r.register_script(_PURGE_SCRIPT)(
+        keys=_SCRIPT_KEYS,
+        args=[_CLIENT_KEY_PREFIX, _expiry_cutoff()]
+    )
+    raw_seconds_per_job = r.get(_SECONDS_PER_JOB_KEY)
+    seconds_per_job = _seconds_per_job(raw_seconds_per_job)
+    return {
+        "queue_depth": depth,
+        "deferred_depth": deferred_depth,
+        "inflight_bytes": inflight_bytes,
+        "seconds_per_job": seconds_per_job,
+        "estimated_wait_seconds": depth * seconds_per_job,
+        "max_queue_depth": config.ADMISSION_MAX_QUEUE_DEPTH,
+        "max_deferred_depth": config.ADMISSION_MAX_DEFERRED_DEPTH,
+        "max_inflight_bytes": config.ADMISSION_MAX_INFLIGHT_BYTES,
+    }
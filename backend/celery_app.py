@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import celeryd_init
 import config
 
 # Initialize Celery application
@@ -14,11 +15,53 @@ celery_app.conf.update(
     accept_content=['json'],
     result_serializer='json',
     enable_utc=True,
+    # Each pipeline stage runs on the queue matching the resource it waits on,
+    # so slow downloads never hold a slot that could be running inference.
+    # After preprocessing, the remaining stages move to the "<queue>.short" or
+    # "<queue>.long" variant matching the probed video duration.
     task_routes={
+        'tasks.fetch_video': {'queue': 'io'},
+        'tasks.preprocess_video': {'queue': 'io'},
+        'tasks.upload_video_to_gemini': {'queue': 'upload'},
+        'tasks.generate_segments': {'queue': 'inference'},
+        'tasks.postprocess_result': {'queue': 'io'},
         'tasks.process_video_for_segmentation': {'queue': 'celery'},
     },
     imports=['tasks'],
+    # Acknowledge only after a stage finishes so a crashed worker's stage is redelivered.
+    # Stages give up after STAGE_MAX_DELIVERIES, so a video that kills its worker is not retried forever.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    broker_transport_options={
+        # Redis emulates message priority with one list per step; lower numbers are consumed first.
+        # Used to keep deferred submissions behind interactive ones.
+        'priority_steps': list(range(10)),
+        # With late acks, a message still unacknowledged after this long is redelivered to another
+        # worker even if the first is still running it; see CELERY_VISIBILITY_TIMEOUT_SECONDS.
+        'visibility_timeout': config.CELERY_VISIBILITY_TIMEOUT_SECONDS,
+    },
+    # Later pipeline stages keep the priority the submission was queued with
+    task_inherit_parent_priority=True,
+    # Don't let a worker reserve low-priority messages ahead of newly arriving interactive work.
+    # Applies to every worker started without --prefetch-multiplier.
+    worker_prefetch_multiplier=1,
 )
 
 # Empty autodiscover to avoid package import issues
-celery_app.autodiscover_tasks([]) 
\ No newline at end of file
+celery_app.autodiscover_tasks([])
+
+
+@celeryd_init.connect
+def configure_worker_pool(conf=None, options=None, **kwargs):
+    """Apply the concurrency of the pool for the queue this worker consumes."""
+    queues = (options or {}).get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    for queue in queues:
+        # Duration-class queues such as "inference.short" share their stage's pool settings
+        pool = config.WORKER_POOLS.get(queue.strip().split('.')[0])
+        if pool:
+            # An explicit -c flag still takes precedence over this default
+            conf.worker_concurrency = pool['concurrency']
+            print(f"Configured worker pool for queue '{queue}': {pool}")
+            break
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Load environment variables from .env file if it exists
@@ -13,14 +14,114 @@ API_PORT = int(os.getenv("API_PORT", "8000"))
 # Google Gemini API
 # If not set, the application will raise an error when attempting to use Gemini features
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
 
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/1")
 
+# Redis for admission control, the URL and probe caches, token usage and task status notifications.
+# Everything shares REDIS_URL; set a feature's own *_REDIS_URL only to move it to another instance.
+REDIS_URL = os.getenv("REDIS_URL", CELERY_RESULT_BACKEND)
+ADMISSION_REDIS_URL = os.getenv("ADMISSION_REDIS_URL", REDIS_URL)
+URL_CACHE_REDIS_URL = os.getenv("URL_CACHE_REDIS_URL", REDIS_URL)
+PROBE_CACHE_REDIS_URL = os.getenv("PROBE_CACHE_REDIS_URL", REDIS_URL)
+USAGE_REDIS_URL = os.getenv("USAGE_REDIS_URL", REDIS_URL)
+STATUS_REDIS_URL = os.getenv("STATUS_REDIS_URL", REDIS_URL)
+
 # Upload directory for video files
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Configuration for development/production
-DEBUG = os.getenv("DEBUG", "True").lower() in ("true", "1", "t") 
\ No newline at end of file
+DEBUG = os.getenv("DEBUG", "True").lower() in ("true", "1", "t") 
+
+# Celery worker concurrency, used to turn queue depth into a wait estimate
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+
+# Admission control for the submission endpoints
+# Counters are kept in Redis so every API process shares the same view of the queue
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "True").lower() in ("true", "1", "t")
+# Hard limits across all clients; exceeding these always returns 429 to protect the upload disk
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "500"))
+ADMISSION_MAX_INFLIGHT_BYTES = int(os.getenv("ADMISSION_MAX_INFLIGHT_BYTES", str(50 * 1024 ** 3)))
+# Cap on tasks waiting in the low-priority lane; deferred tasks do not count toward ADMISSION_MAX_QUEUE_DEPTH
+ADMISSION_MAX_DEFERRED_DEPTH = int(os.getenv("ADMISSION_MAX_DEFERRED_DEPTH", "5000"))
+# Reservations never released (e.g. a worker died mid-chain) stop counting after this long
+ADMISSION_RESERVATION_TTL_SECONDS = int(os.getenv("ADMISSION_RESERVATION_TTL_SECONDS", str(24 * 3600)))
+# Expected seconds per job before any throughput has been observed
+ADMISSION_DEFAULT_JOB_SECONDS = float(os.getenv("ADMISSION_DEFAULT_JOB_SECONDS", "120"))
+# Identify clients by the X-Client-Id header. It is not authenticated, so disable this unless a
+# trusted proxy sets the header; clients are then identified by address only
+ADMISSION_TRUST_CLIENT_ID_HEADER = os.getenv("ADMISSION_TRUST_CLIENT_ID_HEADER", "True").lower() in ("true", "1", "t")
+# Per-client limits. "overflow" is "reject" (429) or "defer" (queue into the low-priority lane).
+ADMISSION_DEFAULT_CLIENT_LIMITS = {
+    "max_queued": int(os.getenv("ADMISSION_CLIENT_MAX_QUEUED", "50")),
+    "max_inflight_bytes": int(os.getenv("ADMISSION_CLIENT_MAX_INFLIGHT_BYTES", str(10 * 1024 ** 3))),
+    "max_wait_seconds": float(os.getenv("ADMISSION_CLIENT_MAX_WAIT_SECONDS", "3600")),
+    "overflow": os.getenv("ADMISSION_CLIENT_OVERFLOW", "reject"),
+}
+# JSON object of per-client overrides, e.g. {"backfill": {"max_queued": 20, "overflow": "defer"}}
+ADMISSION_CLIENT_LIMITS = json.loads(os.getenv("ADMISSION_CLIENT_LIMITS", "{}"))
+# Redis transport priority for the low-priority lane (0 is served first, 9 last)
+ADMISSION_LOW_PRIORITY = int(os.getenv("ADMISSION_LOW_PRIORITY", "9"))
+
+# Cache of segmentation results keyed by source URL, revalidated with ETag/Last-Modified
+URL_CACHE_ENABLED = os.getenv("URL_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+URL_CACHE_TTL_SECONDS = int(os.getenv("URL_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Segmentation pipeline stages
+# Transient failures (network errors, 5xx, rate limits) retry only the failing stage
+STAGE_MAX_RETRIES = int(os.getenv("STAGE_MAX_RETRIES", "3"))
+STAGE_RETRY_BACKOFF_SECONDS = float(os.getenv("STAGE_RETRY_BACKOFF_SECONDS", "10"))
+# A stage whose worker dies mid-run is redelivered; after this many deliveries the job fails instead
+STAGE_MAX_DELIVERIES = int(os.getenv("STAGE_MAX_DELIVERIES", "3"))
+# A stage running longer than this fails the job (soft limit), and its process is killed a minute later
+STAGE_TIME_LIMIT_SECONDS = int(os.getenv("STAGE_TIME_LIMIT_SECONDS", "3600"))
+# Highest --prefetch-multiplier any worker is started with (the io worker in the run scripts)
+WORKER_MAX_PREFETCH_MULTIPLIER = int(os.getenv("WORKER_MAX_PREFETCH_MULTIPLIER", "4"))
+# The Redis broker hands an unacknowledged message to another worker after this long. Stages are
+# acknowledged late, so it must outlast a message waiting behind up to a prefetch multiplier's worth
+# of stages in its worker's buffer and then running for the full stage time limit.
+CELERY_VISIBILITY_TIMEOUT_SECONDS = int(os.getenv(
+    "CELERY_VISIBILITY_TIMEOUT_SECONDS",
+    str((STAGE_TIME_LIMIT_SECONDS + 60) * (WORKER_MAX_PREFETCH_MULTIPLIER + 1))
+))
+
+# Worker pool settings per queue, applied to a worker started with `-Q <queue>`
+# io: downloads, validation and cleanup; upload: Gemini File API upload and ACTIVE polling;
+# inference: content generation
+# Prefetch is not set here: Celery fills --prefetch-multiplier from the global setting before
+# any signal can change it, so the run scripts pass it on each worker's command line instead
+WORKER_POOLS = {
+    "io": {
+        "concurrency": int(os.getenv("IO_WORKER_CONCURRENCY", "8")),
+    },
+    "upload": {
+        "concurrency": int(os.getenv("UPLOAD_WORKER_CONCURRENCY", "8")),
+    },
+    "inference": {
+        "concurrency": int(os.getenv("INFERENCE_WORKER_CONCURRENCY", str(WORKER_CONCURRENCY))),
+    },
+}
+
+# Video probing, cached by content hash
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+PROBE_CACHE_TTL_SECONDS = int(os.getenv("PROBE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Used to estimate duration from file size when ffprobe is unavailable (~4 Mbit/s)
+PROBE_FALLBACK_BYTES_PER_SECOND = float(os.getenv("PROBE_FALLBACK_BYTES_PER_SECOND", "500000"))
+
+# Duration classes: videos up to SHORT go to the *.short queues, longer than MEDIUM to *.long
+SCHEDULE_SHORT_MAX_SECONDS = float(os.getenv("SCHEDULE_SHORT_MAX_SECONDS", "120"))
+SCHEDULE_MEDIUM_MAX_SECONDS = float(os.getenv("SCHEDULE_MEDIUM_MAX_SECONDS", "900"))
+
+# Video sampling sent to Gemini
+# Default prompt token budget per task when a request sets none (0 = use Gemini's default sampling)
+SAMPLING_DEFAULT_TOKEN_BUDGET = int(os.getenv("SAMPLING_DEFAULT_TOKEN_BUDGET", "0"))
+# Lowest frame rate the budget-driven sampling will go down to
+SAMPLING_MIN_FPS = float(os.getenv("SAMPLING_MIN_FPS", "0.1"))
+
+# Task status layer in the API: in-process cache fed by worker notifications
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+# Non-terminal states are re-read from the result backend at most this often, in case a notification was missed
+STATUS_REFRESH_SECONDS = float(os.getenv("STATUS_REFRESH_SECONDS", "5"))
@@ -0,0 +1,437 @@
+import os
+import csv
+import json
+import time
+import uuid
+import shutil
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List, Optional
+
+import requests
+
+from file_hash import file_sha256
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpeg", ".mpg"}
+
+# Item states recorded in the checkpoint manifest
+STATUS_PENDING = "pending"
+STATUS_SUBMITTED = "submitted"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+def discover_sources(source: str) -> List[Dict[str, str]]:
+    """
+    List the videos to ingest from a dataset directory or a manifest file.
+
+    A directory is walked recursively for video files. A manifest is a CSV with a
+    `url` or `path` column, or a plain list with one URL or path per line.
+    """
+    if os.path.isdir(source):
+        found = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS:
+                    found.append({"path": os.path.abspath(os.path.join(root, name))})
+        return sorted(found, key=lambda s: s["path"])
+
+    manifest_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", newline="") as f:
+        first_line = f.readline()
+        f.seek(0)
+        header = [column.strip().lower() for column in first_line.split(",")]
+        if "url" in header or "path" in header:
+            rows = [
+                {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+                for row in csv.DictReader(f)
+            ]
+        else:
+            rows = [{"entry": line.strip()} for line in f if line.strip() and not line.startswith("#")]
+
+    found = []
+    for row in rows:
+        entry = row.get("url") or row.get("path") or row.get("entry")
+        if not entry:
+            continue
+        if entry.startswith(("http://", "https://")):
+            found.append({"url": entry})
+        else:
+            path = entry if os.path.isabs(entry) else os.path.join(manifest_dir, entry)
+            found.append({"path": os.path.abspath(path)})
+    return found
+
+
+class IngestState:
+    """
+    Checkpointed local manifest of an ingest run.
+
+    Items are keyed by content hash (files) or URL, so a rerun skips anything
+    already processed even if files were renamed or moved. Every change is appended
+    as one line to a journal next to the manifest, so a checkpoint costs the same
+    however large the run is, and a crash loses at most the in-flight requests.
+    Loading replays the journal over the last snapshot; save() folds it back in.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self._lock = threading.Lock()
+        self.items: Dict[str, Dict[str, Any]] = {}
+        # (path, size, mtime) -> sha256, so unchanged files are not rehashed on resume
+        self.hashes: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.items = data.get("items", {})
+            self.hashes = data.get("hashes", {})
+        if os.path.exists(self.journal_path):
+            self._replay()
+        self._journal = open(self.journal_path, "a")
+        # Start from a fresh journal, so new changes never follow a line cut short by a crash
+        self.save()
+
+    def _replay(self) -> None:
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if "hash" in change:
+                    self.hashes[change["hash"]] = change["digest"]
+                else:
+                    self.items.setdefault(change["key"], {}).update(change["fields"])
+
+    def _append_locked(self, change: Dict[str, Any]) -> None:
+        self._journal.write(json.dumps(change) + "\n")
+        self._journal.flush()
+
+    def key_for(self, source: Dict[str, str]) -> str:
+        if "url" in source:
+            return f"url:{source['url']}"
+        stat = os.stat(source["path"])
+        fingerprint = f"{source['path']}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            digest = self.hashes.get(fingerprint)
+        if digest is None:
+            digest = file_sha256(source["path"])
+            with self._lock:
+                self.hashes[fingerprint] = digest
+                self._append_locked({"hash": fingerprint, "digest": digest})
+        return f"sha256:{digest}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self.items.get(key)
+            return dict(item) if item else None
+
+    def update(self, key: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        with self._lock:
+            self.items.setdefault(key, {}).update(fields)
+            self._append_locked({"key": key, "fields": fields})
+
+    def save(self) -> None:
+        """Write a full snapshot and start a new, empty journal."""
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"items": self.items, "hashes": self.hashes}, f)
+            os.replace(tmp_path, self.path)
+            # Replaying the old journal over the new snapshot would be harmless, so a crash here is safe
+            self._journal.close()
+            self._journal = open(self.journal_path, "w")
+
+    def close(self) -> None:
+        with self._lock:
+            self._journal.close()
+
+
+class ApiSubmitter:
+    """Submits videos through the public HTTP endpoints, honouring 429 Retry-After."""
+
+    def __init__(
+        self,
+        api_url: str,
+        client_id: str,
+        poll_interval: float,
+        max_wait_seconds: float,
+        sampling_settings: Optional[Dict[str, Any]] = None
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.headers = {"X-Client-Id": client_id}
+        self.sampling_settings = sampling_settings or {}
+        self.poll_interval = poll_interval
+        self.max_wait_seconds = max_wait_seconds
+
+    def submit(self, source: Dict[str, str]) -> str:
+        while True:
+            if "url" in source:
+                response = requests.post(
+                    f"{self.api_url}/process_video_from_url/",
+                    json={"video_url": source["url"], **self.sampling_settings},
+                    headers=self.headers,
+                    timeout=60
+                )
+            else:
+                with open(source["path"], "rb") as f:
+                    response = requests.post(
+                        f"{self.api_url}/upload_video/",
+                        files={"file": (os.path.basename(source["path"]), f, mimetypes.guess_type(source["path"])[0] or "video/mp4")},
+                        data=self.sampling_settings,
+                        headers=self.headers,
+                        timeout=600
+                    )
+            if response.status_code == 429:
+                retry_after = float(response.headers.get("Retry-After", "30"))
+                print(f"Server busy, retrying {_describe(source)} in {retry_after:.0f}s")
+                time.sleep(retry_after)
+                continue
+            response.raise_for_status()
+            return response.json()["task_id"]
+
+    def wait(self, task_id: str) -> Dict[str, Any]:
+        deadline = time.time() + self.max_wait_seconds
+        while time.time() < deadline:
+            response = requests.get(f"{self.api_url}/tasks/{task_id}/result", headers=self.headers, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            if data["status"] in ("SUCCESS", "FAILURE", "ERROR"):
+                return data
+            time.sleep(self.poll_interval)
+        raise TimeoutError(f"Task {task_id} did not finish within {self.max_wait_seconds:.0f}s")
+
+
+class DirectSubmitter:
+    """Submits videos straight to the Celery pipeline, bypassing the HTTP API."""
+
+    def __init__(
+        self,
+        client_id: str,
+        poll_interval: float,
+        max_wait_seconds: float,
+        sampling_settings: Optional[Dict[str, Any]] = None
+    ):
+        # Imported lazily so the API mode works without the worker dependencies
+        import config
+        from tasks import build_segmentation_pipeline
+        self._config = config
+        self._build_pipeline = build_segmentation_pipeline
+        self.client_id = client_id
+        self.sampling_settings = sampling_settings or {}
+        self.poll_interval = poll_interval
+        self.max_wait_seconds = max_wait_seconds
+
+    def submit(self, source: Dict[str, str]) -> str:
+        task_id = str(uuid.uuid4())
+        if "url" in source:
+            pipeline = self._build_pipeline(
+                task_id, video_url=source["url"], client_id=self.client_id, sampling_settings=self.sampling_settings
+            )
+        else:
+            # The worker deletes its input after processing, so hand it a copy in the upload directory
+            file_path = os.path.join(self._config.UPLOAD_DIR, f"{task_id}{os.path.splitext(source['path'])[1]}")
+            shutil.copyfile(source["path"], file_path)
+            pipeline = self._build_pipeline(
+                task_id, video_path=file_path, client_id=self.client_id, sampling_settings=self.sampling_settings
+            )
+        pipeline.apply_async(task_id=task_id)
+        return task_id
+
+    def wait(self, task_id: str) -> Dict[str, Any]:
+        from celery.result import AsyncResult
+        from celery_app import celery_app
+        # Poll rather than block in get(): the Redis result consumer is not safe to share across threads
+        task_result = AsyncResult(task_id, app=celery_app)
+        deadline = time.time() + self.max_wait_seconds
+        while not task_result.ready():
+            if time.time() >= deadline:
+                raise TimeoutError(f"Task {task_id} did not finish within {self.max_wait_seconds:.0f}s")
+            time.sleep(self.poll_interval)
+        result = task_result.result
+        if isinstance(result, dict) and "error" not in result:
+            return {"task_id": task_id, "status": "SUCCESS", "result": result}
+        error = result.get("error") if isinstance(result, dict) else str(result)
+        return {"task_id": task_id, "status": "FAILURE", "error": error}
+
+
+class ProgressReporter:
+    """Periodically prints completed count, throughput and ETA for the current run."""
+
+    def __init__(self, total: int, interval: float = 10.0):
+        self.total = total
+        self.interval = interval
+        self.completed = 0
+        self.failed = 0
+        self.started_at = time.time()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, succeeded: bool) -> None:
+        with self._lock:
+            self.completed += 1
+            if not succeeded:
+                self.failed += 1
+            if time.time() - self._last_report >= self.interval or self.completed == self.total:
+                self._last_report = time.time()
+                print(self.summary())
+
+    def summary(self) -> str:
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        rate = self.completed / elapsed
+        remaining = self.total - self.completed
+        eta = f"{remaining / rate:.0f}s" if rate > 0 else "unknown"
+        return (f"[ingest] {self.completed}/{self.total} done ({self.failed} failed), "
+                f"{rate * 60:.1f} videos/min, ETA {eta}")
+
+
+def _describe(source: Dict[str, str]) -> str:
+    return source.get("url") or source.get("path")
+
+
+def _process_one(submitter, state: IngestState, key: str, source: Dict[str, str]) -> bool:
+    item = state.get(key) or {}
+    task_id = item.get("task_id") if item.get("status") == STATUS_SUBMITTED else None
+    if task_id:
+        print(f"Resuming {_describe(source)} (task {task_id})")
+    else:
+        try:
+            task_id = submitter.submit(source)
+        except Exception as e:
+            print(f"Error submitting {_describe(source)}: {str(e)}")
+            state.update(key, status=STATUS_FAILED, error=str(e))
+            return False
+        state.update(key, status=STATUS_SUBMITTED, task_id=task_id, poll_error=None)
+
+    try:
+        outcome = submitter.wait(task_id)
+    except Exception as e:
+        # The task may still be running (API restart, poll timeout), so stay submitted
+        # and resume polling on the next run instead of paying for it a second time
+        print(f"Error waiting for {_describe(source)} (task {task_id}), will resume on the next run: {str(e)}")
+        state.update(key, poll_error=str(e))
+        return False
+    if outcome["status"] == "SUCCESS":
+        state.update(key, status=STATUS_DONE, result=outcome.get("result"), error=None, poll_error=None)
+        return True
+    state.update(key, status=STATUS_FAILED, error=outcome.get("error") or outcome["status"], poll_error=None)
+    return False
+
+
+def run_ingest(
+    source: str,
+    state_path: str,
+    output_path: str,
+    submitter,
+    concurrency: int = 4,
+    retry_failed: bool = False
+) -> Dict[str, Any]:
+    """
+    Ingest every video from `source`, resuming from the checkpoint at `state_path`.
+
+    Returns a summary dict and writes consolidated results to `output_path`.
+    """
+    state = IngestState(state_path)
+    sources = discover_sources(source)
+    print(f"Found {len(sources)} videos in {source}")
+
+    def key_or_error(src: Dict[str, str]):
+        try:
+            return state.key_for(src), None
+        except OSError as e:
+            return None, str(e)
+
+    # Hashing is I/O bound, so fingerprint new files in parallel before deciding what to skip
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        keys = list(executor.map(key_or_error, sources))
+
+    work = []
+    skipped = 0
+    unreadable = 0
+    seen = set()
+    for (key, error), src in zip(keys, sources):
+        if error is not None:
+            # Missing or unreadable files cannot be hashed; record them by path and carry on
+            print(f"Error reading {_describe(src)}: {error}")
+            state.update(f"path:{src['path']}", status=STATUS_FAILED, source=_describe(src), error=error)
+            unreadable += 1
+            continue
+        item = state.get(key) or {}
+        # Identical content listed twice is only processed once
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        if item.get("status") == STATUS_DONE or (item.get("status") == STATUS_FAILED and not retry_failed):
+            skipped += 1
+            continue
+        if item.get("status") != STATUS_SUBMITTED:
+            state.update(key, status=STATUS_PENDING, source=_describe(src))
+        work.append((key, src))
+    state.save()
+    print(f"Skipping {skipped} already processed, {unreadable} unreadable, {len(work)} to go")
+
+    reporter = ProgressReporter(len(work))
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = [executor.submit(_process_one, submitter, state, key, src) for key, src in work]
+        for future in as_completed(futures):
+            reporter.record(future.result())
+    state.save()
+    state.close()
+
+    results = [
+        {
+            "key": key,
+            "source": item.get("source"),
+            "task_id": item.get("task_id"),
+            "status": item.get("status"),
+            "action_segments": (item.get("result") or {}).get("action_segments"),
+            "error": item.get("error") or item.get("poll_error"),
+        }
+        for key, item in sorted(state.items.items(), key=lambda kv: kv[1].get("source") or "")
+    ]
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, output_path)
+
+    summary = {
+        "total": len(sources),
+        "skipped": skipped,
+        "unreadable": unreadable,
+        "processed": reporter.completed,
+        "failed": reporter.failed,
+        "elapsed_seconds": time.time() - reporter.started_at,
+        "output": output_path,
+    }
+    print(f"{reporter.summary()}. Results written to {output_path}")
+    return summary
+
+
+def add_arguments(parser) -> None:
+    """Register the `ingest` command-line options on an argparse parser."""
+    parser.add_argument("source", help="Dataset directory, CSV manifest (url/path column) or list of URLs/paths")
+    parser.add_argument("--state", help="Checkpoint manifest path (default: <source>.ingest_state.json)")
+    parser.add_argument("--output", help="Consolidated results path (default: <source>.results.json)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum videos in flight at once")
+    parser.add_argument("--api-url", default="http://localhost:8000", help="Base URL of the RoboSeg API")
+    parser.add_argument("--client-id", default="ingest", help="X-Client-Id sent to the API for admission control")
+    parser.add_argument("--direct", action="store_true", help="Submit straight to the Celery pipeline instead of the API")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between result polls")
+    parser.add_argument("--task-timeout", type=float, default=3 * 3600, help="Give up waiting on a task after this many seconds")
+    parser.add_argument("--token-budget", type=int, help="Prompt token budget per video; picks frame rate and resolution")
+    parser.add_argument("--retry-failed", action="store_true", help="Resubmit items that failed in a previous run")
+
+
+def main(args) -> None:
+    base = os.path.abspath(args.source).rstrip(os.sep)
+    state_path = args.state or f"{base}.ingest_state.json"
+    output_path = args.output or f"{base}.results.json"
+    sampling_settings = {"token_budget": args.token_budget} if args.token_budget else {}
+    if args.direct:
+        submitter = DirectSubmitter(args.client_id, args.poll_interval, args.task_timeout, sampling_settings)
+    else:
+        submitter = ApiSubmitter(args.api_url, args.client_id, args.poll_interval, args.task_timeout, sampling_settings)
+    run_ingest(args.source, state_path, output_path, submitter, args.concurrency, args.retry_failed)
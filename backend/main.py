@@ -1,8 +1,9 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Path
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Path, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 import uvicorn
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import config
 import os
 import tempfile
@@ -10,17 +11,48 @@ import json
 import time
 import shutil
 import uuid
-from celery.result import AsyncResult
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
 
+import admission
+import usage
+import task_status
 # Import models from models.py
-from models import ActionSegment, SegmentationResponse, TaskResponse, TaskStatusResponse, TaskResultResponse, VideoURLRequest
-# Import Celery task
-from tasks import process_video_for_segmentation
-# Import Celery application
-from celery_app import celery_app
+from models import ActionSegment, SegmentationResponse, TaskResponse, TaskStatusResponse, TaskResultResponse, VideoURLRequest, SamplingSettings, UsageRecord, TaskStatusBatchRequest, TaskStatusBatchResponse
+# Import Celery pipeline
+from tasks import build_segmentation_pipeline
 
 app = FastAPI(title="Robot Data Segmentation Agent")
 
+# Registered before CORS so CORS stays the outermost middleware and 429s still carry its headers
+@app.middleware("http")
+async def admit_uploads_before_reading_body(request: Request, call_next):
+    """
+    Run admission for video uploads on their Content-Length, before the body is read.
+
+    FastAPI spools the whole multipart form to disk before the endpoint runs, so checking
+    there would let a rejected upload use up the disk and bandwidth admission protects.
+    The reservation is handed to the endpoint through request.state and given back here
+    unless the endpoint queued the task.
+    """
+    content_length = request.headers.get("content-length", "")
+    if request.method != "POST" or request.url.path != "/upload_video/" or not content_length.isdigit():
+        return await call_next(request)
+
+    task_id = str(uuid.uuid4())
+    client_id = admission.client_id_for(request.headers, request.client.host if request.client else None)
+    try:
+        decision = await _admit_or_reject(task_id, client_id, int(content_length))
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+
+    request.state.admission = (task_id, client_id, decision)
+    try:
+        return await call_next(request)
+    finally:
+        if not getattr(request.state, "task_queued", False):
+            await run_in_threadpool(admission.cancel, task_id)
+
 # Add CORS middleware to allow frontend to communicate with backend
 app.add_middleware(
     CORSMiddleware,
@@ -38,13 +70,68 @@ async def health_check() -> Dict[str, str]:
     """Simple health check endpoint."""
     return {"status": "ok"}
 
+async def _admit_or_reject(task_id: str, client_id: str, size_bytes: int) -> admission.AdmissionDecision:
+    """Run admission control for a submission and raise 429 with Retry-After if it is refused."""
+    # Admission talks to Redis synchronously, so keep it off the event loop
+    decision = await run_in_threadpool(admission.admit, task_id, client_id, size_bytes)
+    if not decision.admitted:
+        print(f"Rejected task {task_id} for client {client_id}: {decision.reason}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many queued tasks: {decision.reason}. Retry in {decision.retry_after_seconds}s.",
+            headers={"Retry-After": str(decision.retry_after_seconds)}
+        )
+    return decision
+
+def _upload_size(file: UploadFile) -> int:
+    """Size of an uploaded file in bytes, measured on the spooled upload before it is copied."""
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(position)
+    return size
+
+@app.get("/admission")
+async def admission_status() -> Dict[str, Any]:
+    """Current queue depth, in-flight bytes and wait estimate used by admission control."""
+    try:
+        return await run_in_threadpool(admission.snapshot)
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Admission control state unavailable: {str(e)}"
+        )
+
+@app.get("/usage", response_model=List[UsageRecord])
+async def get_usage(
+    days: int = Query(7, ge=1, le=366, description="Number of days to report, today included"),
+    client_id: Optional[str] = Query(None, description="Only report this client")
+) -> List[Dict[str, Any]]:
+    """Gemini token usage aggregated per UTC day and per client, newest day first."""
+    try:
+        return await run_in_threadpool(usage.summary, days, client_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Usage data unavailable: {str(e)}"
+        )
+
 @app.post("/upload_video/", response_model=TaskResponse)
-async def upload_video(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def upload_video(
+    request: Request,
+    file: UploadFile = File(...),
+    fps: Optional[float] = Form(None, description="Frames per second sampled from the video"),
+    media_resolution: Optional[str] = Form(None, description="Resolution of sampled frames: low, medium or high"),
+    token_budget: Optional[int] = Form(None, description="Prompt token budget used to pick fps/resolution automatically")
+) -> Dict[str, Any]:
     """
     Upload a video file and queue it for asynchronous processing with Gemini API.
     
     The endpoint immediately returns a task_id that can be used to check the status
-    and retrieve results later.
+    and retrieve results later. Returns 429 with a Retry-After header when the
+    submission exceeds the admission limits for the calling client.
     """
     if not config.GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
@@ -54,8 +141,22 @@ async def upload_video(file: UploadFile = File(...)) -> Dict[str, Any]:
         raise HTTPException(status_code=400, detail="File must be a video")
     
     try:
-        # Generate unique task ID and filename
+        sampling_settings = SamplingSettings(fps=fps, media_resolution=media_resolution, token_budget=token_budget)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    
+    # Normally admitted from Content-Length before the body was read; without that header
+    # (e.g. a chunked upload) admission runs now, still before anything is written to the upload directory
+    reservation = getattr(request.state, "admission", None)
+    if reservation:
+        task_id, client_id, decision = reservation
+    else:
         task_id = str(uuid.uuid4())
+        client_id = admission.client_id_for(request.headers, request.client.host if request.client else None)
+        decision = await _admit_or_reject(task_id, client_id, _upload_size(file))
+    
+    try:
+        # Generate unique filename
         file_extension = os.path.splitext(file.filename)[1]
         unique_filename = f"{task_id}{file_extension}"
         file_path = os.path.join(config.UPLOAD_DIR, unique_filename)
@@ -66,8 +167,18 @@ async def upload_video(file: UploadFile = File(...)) -> Dict[str, Any]:
         
         # Queue the Celery task for processing
         # Store Celery task ID in a file for debugging and cross-referencing
-        celery_task = process_video_for_segmentation.delay(task_id=task_id, video_path=file_path)
+        # The final pipeline stage is stored under our task_id, so status lookups work on either id
+        celery_task = build_segmentation_pipeline(
+            task_id,
+            video_path=file_path,
+            client_id=client_id,
+            sampling_settings=sampling_settings.model_dump(exclude_none=True)
+        ).apply_async(
+            task_id=task_id,
+            priority=decision.priority
+        )
         celery_task_id = celery_task.id
+        request.state.task_queued = True
         
         # Store mapping between our task_id and celery's task_id
         print(f"Created task mapping: App task_id={task_id} -> Celery task_id={celery_task_id}")
@@ -79,37 +190,53 @@ async def upload_video(file: UploadFile = File(...)) -> Dict[str, Any]:
                 "app_task_id": task_id,
                 "celery_task_id": celery_task_id,
                 "file_path": file_path,
+                "client_id": client_id,
+                "priority": decision.priority,
                 "created_at": time.time()
             }))
         
         return {
             "task_id": task_id,
-            "message": "Video processing task started"
+            "message": "Video processing task queued in low-priority lane" if decision.deferred else "Video processing task started",
+            "estimated_wait_seconds": decision.estimated_wait_seconds
         }
     
     except Exception as e:
+        await run_in_threadpool(admission.cancel, task_id)
         raise HTTPException(
             status_code=500, 
             detail=f"Error starting video processing task: {str(e)}"
         )
 
 @app.post("/process_video_from_url/", response_model=TaskResponse)
-async def process_video_from_url(request: VideoURLRequest) -> Dict[str, Any]:
+async def process_video_from_url(request: VideoURLRequest, http_request: Request) -> Dict[str, Any]:
     """
     Process a video from the provided URL using Gemini API.
     
     The endpoint immediately returns a task_id that can be used to check the status
-    and retrieve results later.
+    and retrieve results later. Returns 429 with a Retry-After header when the
+    submission exceeds the admission limits for the calling client.
     """
     if not config.GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
     
+    # The download size is unknown until the worker fetches it, so only the task count is reserved here;
+    # the worker adds the downloaded bytes to the reservation
+    task_id = str(uuid.uuid4())
+    client_id = admission.client_id_for(http_request.headers, http_request.client.host if http_request.client else None)
+    decision = await _admit_or_reject(task_id, client_id, 0)
+    
     try:
-        # Generate unique task ID
-        task_id = str(uuid.uuid4())
-        
         # Queue the Celery task for processing
-        celery_task = process_video_for_segmentation.delay(task_id=task_id, video_url=str(request.video_url))
+        celery_task = build_segmentation_pipeline(
+            task_id,
+            video_url=str(request.video_url),
+            client_id=client_id,
+            sampling_settings=request.model_dump(include={"fps", "media_resolution", "token_budget"}, exclude_none=True)
+        ).apply_async(
+            task_id=task_id,
+            priority=decision.priority
+        )
         celery_task_id = celery_task.id
         
         # Store mapping between our task_id and celery's task_id
@@ -122,20 +249,54 @@ async def process_video_from_url(request: VideoURLRequest) -> Dict[str, Any]:
                 "app_task_id": task_id,
                 "celery_task_id": celery_task_id,
                 "video_url": str(request.video_url),
+                "client_id": client_id,
+                "priority": decision.priority,
                 "created_at": time.time()
             }))
         
         return {
             "task_id": task_id,
-            "message": "Video URL processing task started"
+            "message": "Video URL processing task queued in low-priority lane" if decision.deferred else "Video URL processing task started",
+            "estimated_wait_seconds": decision.estimated_wait_seconds
         }
     
     except Exception as e:
+        await run_in_threadpool(admission.cancel, task_id)
         raise HTTPException(
             status_code=500, 
             detail=f"Error starting video URL processing task: {str(e)}"
         )
 
+@app.on_event("startup")
+async def start_task_status_listener() -> None:
+    """Subscribe to worker status notifications so task status is served from memory."""
+    task_status.start_listener()
+
+@app.post("/tasks/status", response_model=TaskStatusBatchResponse)
+async def get_task_statuses(request: TaskStatusBatchRequest) -> Dict[str, Any]:
+    """
+    Check the status of many video processing tasks in one request.
+    
+    Cached states are answered from memory; the rest are read from the result
+    backend in a single round trip.
+    """
+    try:
+        entries = await run_in_threadpool(task_status.get_many, request.task_ids)
+        return {
+            "statuses": [
+                {"task_id": task_id, "status": entries[task_id]["status"]}
+                for task_id in request.task_ids
+            ]
+        }
+    
+    except Exception as e:
+        import traceback
+        print(f"Error in get_task_statuses: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error retrieving task statuses: {str(e)}"
+        )
+
 @app.get("/tasks/{task_id}/status", response_model=TaskStatusResponse)
 async def get_task_status(task_id: str = Path(..., description="ID of the task to check")) -> Dict[str, Any]:
     """
@@ -144,52 +305,10 @@ async def get_task_status(task_id: str = Path(..., description="ID of the task t
     Returns the current status of the task: PENDING, STARTED, SUCCESS, FAILURE, etc.
     """
     try:
-        # Check if we have a task mapping file to get the Celery task ID
-        celery_task_id = None
-        mapping_path = os.path.join(config.UPLOAD_DIR, f"{task_id}.task_info")
-        if os.path.exists(mapping_path):
-            try:
-                with open(mapping_path, "r") as f:
-                    mapping_data = json.loads(f.read())
-                    celery_task_id = mapping_data.get("celery_task_id")
-                    print(f"Found task mapping file: {task_id} -> {celery_task_id}")
-            except Exception as e:
-                print(f"Error reading task mapping file: {str(e)}")
-        
-        # First try with the original task ID
-        task_result = AsyncResult(task_id, app=celery_app)
-        
-        # If we have a celery task ID and the original task ID doesn't have a valid state,
-        # try with the Celery task ID
-        if celery_task_id and task_result.state == 'PENDING':
-            print(f"Trying with Celery task ID: {celery_task_id}")
-            celery_task_result = AsyncResult(celery_task_id, app=celery_app)
-            if celery_task_result.state != 'PENDING':
-                print(f"Using Celery task result with state: {celery_task_result.state}")
-                task_result = celery_task_result
-        
-        # Get the current state (no refresh method available in AsyncResult)
-        current_state = task_result.state
-        print(f"Task {task_id} current state: {current_state}")
-        
-        # Check if task exists in backend (only if backend has exists method)
-        if task_result.backend and hasattr(task_result.backend, 'exists') and not task_result.backend.exists(task_result.id):
-            print(f"Task {task_id} not found in result backend")
-            
-        # If pending for too long, check if the task is actually completed
-        if current_state == 'PENDING':
-            # Check if we can get a result anyway (some tasks complete but don't update status)
-            try:
-                result = task_result.get(timeout=0.1)  # Very short timeout to just check if result exists
-                if result:
-                    print(f"Task {task_id} has result despite PENDING status: {result}")
-                    current_state = 'SUCCESS'  # Override the state if we have a result
-            except Exception as e:
-                print(f"Attempted to get result for PENDING task {task_id}: {str(e)}")
-        
+        entry = await run_in_threadpool(task_status.get, task_id)
         return {
             "task_id": task_id,
-            "status": current_state
+            "status": entry["status"]
         }
     
     except Exception as e:
@@ -210,109 +329,26 @@ async def get_task_result(task_id: str = Path(..., description="ID of the task t
     If the task failed, returns error information.
     """
     try:
-        # Check if we have a task mapping file to get the Celery task ID
-        celery_task_id = None
-        mapping_path = os.path.join(config.UPLOAD_DIR, f"{task_id}.task_info")
-        if os.path.exists(mapping_path):
-            try:
-                with open(mapping_path, "r") as f:
-                    mapping_data = json.loads(f.read())
-                    celery_task_id = mapping_data.get("celery_task_id")
-                    print(f"Found task mapping file for result: {task_id} -> {celery_task_id}")
-            except Exception as e:
-                print(f"Error reading task mapping file for result: {str(e)}")
+        entry = await run_in_threadpool(task_status.get, task_id)
         
-        # First try with the original task ID
-        task_result = AsyncResult(task_id, app=celery_app)
-        
-        # If we have a celery task ID and the original task ID doesn't show results,
-        # try with the Celery task ID
-        if celery_task_id and task_result.state == 'PENDING':
-            print(f"Trying result with Celery task ID: {celery_task_id}")
-            celery_task_result = AsyncResult(celery_task_id, app=celery_app)
-            if celery_task_result.state != 'PENDING':
-                print(f"Using Celery task result with state: {celery_task_result.state}")
-                task_result = celery_task_result
+        if entry["status"] == "SUCCESS":
+            return {
+                "task_id": task_id,
+                "status": "SUCCESS",
+                "result": entry["result"]
+            }
         
-        # Get the current state (no refresh method available in AsyncResult)
-        current_state = task_result.state
-        print(f"Getting result for task {task_id}, current state: {current_state}")
+        elif entry["status"] == "FAILURE":
+            return {
+                "task_id": task_id,
+                "status": "FAILURE",
+                "error": entry["error"]
+            }
         
-        # Try to get result even if state says PENDING (could be a state reporting issue)
-        try:
-            if current_state == 'PENDING':
-                # Check if task has been running for a while (in case it's done but status not updated)
-                mapping_file_time = 0
-                try:
-                    if os.path.exists(mapping_path):
-                        with open(mapping_path, "r") as f:
-                            mapping_data = json.loads(f.read())
-                            created_at = mapping_data.get("created_at", 0)
-                            task_age = time.time() - created_at
-                            print(f"Task age: {task_age} seconds")
-                            
-                            # If task is older than 20 seconds and still PENDING, try to get result
-                            if task_age > 20:
-                                print(f"Task is older than 20 seconds, attempting to force result retrieval")
-                                try:
-                                    result = task_result.get(timeout=0.5)
-                                    if result:
-                                        print(f"Found result for aged task {task_id} despite PENDING status")
-                                        current_state = 'SUCCESS'
-                                except Exception as e:
-                                    print(f"No result available for aged PENDING task {task_id}: {str(e)}")
-                except Exception as e:
-                    print(f"Error checking task age: {str(e)}")
-                
-                # Try to get result with a short timeout as a final check
-                if current_state == 'PENDING':
-                    try:
-                        result = task_result.get(timeout=0.5)
-                        if result:
-                            print(f"Found result for task {task_id} despite PENDING status")
-                            current_state = 'SUCCESS'
-                    except Exception as e:
-                        print(f"No result available for PENDING task {task_id}: {str(e)}")
-                        # Keep the PENDING state
-            
-            # Handle based on current state (which might have been updated)    
-            if current_state == 'SUCCESS':
-                # For SUCCESS state, we can safely try to get the result
-                result = task_result.get()
-                
-                # Check if result contains error
-                if isinstance(result, dict) and 'error' in result:
-                    return {
-                        "task_id": task_id,
-                        "status": "FAILURE",
-                        "error": result['error']
-                    }
-                
-                return {
-                    "task_id": task_id,
-                    "status": "SUCCESS",
-                    "result": result
-                }
-            
-            elif current_state == 'FAILURE':
-                return {
-                    "task_id": task_id,
-                    "status": "FAILURE",
-                    "error": str(task_result.info)
-                }
-            
-            else:
-                return {
-                    "task_id": task_id,
-                    "status": current_state
-                }
-                
-        except Exception as result_e:
-            print(f"Error retrieving result for task {task_id}: {str(result_e)}")
+        else:
             return {
                 "task_id": task_id,
-                "status": "ERROR",
-                "error": f"Error retrieving result: {str(result_e)}"
+                "status": entry["status"]
             }
     
     except Exception as e:
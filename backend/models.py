@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, HttpUrl
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
 
 class ActionSegment(BaseModel):
     """Model for a single action segment with start and end times"""
@@ -7,21 +7,44 @@ class ActionSegment(BaseModel):
     end_time: str = Field(..., description="End time of the segment in MM:SS format")
     action: str = Field(..., description="Description of the robot action")
 
+class SamplingSettings(BaseModel):
+    """Per-task video sampling sent to Gemini; unset values are chosen from the token budget"""
+    fps: Optional[float] = Field(None, gt=0, le=24, description="Frames per second sampled from the video")
+    media_resolution: Optional[Literal["low", "medium", "high"]] = Field(None, description="Resolution of sampled frames")
+    token_budget: Optional[int] = Field(None, gt=0, description="Prompt token budget used to pick fps/resolution automatically")
+
+class TokenUsage(BaseModel):
+    """Gemini token counts for one task"""
+    prompt_token_count: int = 0
+    response_token_count: int = 0
+    total_token_count: int = 0
+
 class SegmentationResponse(BaseModel):
     """Response model containing a list of action segments"""
     action_segments: List[ActionSegment] = Field(alias="action_segments")
     downloaded_video_path: Optional[str] = None
+    sampling: Optional[Dict[str, Any]] = Field(None, description="Sampling actually applied (fps, media_resolution, token estimate)")
+    usage: Optional[TokenUsage] = Field(None, description="Token usage; empty when the result came from the cache")
 
 class TaskResponse(BaseModel):
     """Response model for task creation"""
     task_id: str
     message: str
+    estimated_wait_seconds: Optional[float] = None
 
 class TaskStatusResponse(BaseModel):
     """Response model for task status"""
     task_id: str
     status: str
 
+class TaskStatusBatchRequest(BaseModel):
+    """Request model for checking many task statuses at once"""
+    task_ids: List[str] = Field(..., min_length=1, max_length=1000, description="IDs of the tasks to check")
+
+class TaskStatusBatchResponse(BaseModel):
+    """Response model with the status of each requested task, in request order"""
+    statuses: List[TaskStatusResponse]
+
 class TaskResultResponse(BaseModel):
     """Response model for task result"""
     task_id: str
@@ -29,6 +52,15 @@ class TaskResultResponse(BaseModel):
     result: Optional[SegmentationResponse] = None
     error: Optional[str] = None
 
-class VideoURLRequest(BaseModel):
+class VideoURLRequest(SamplingSettings):
     """Request model for video URL processing"""
-    video_url: HttpUrl = Field(..., description="URL of the video to process") 
\ No newline at end of file
+    video_url: HttpUrl = Field(..., description="URL of the video to process")
+
+class UsageRecord(BaseModel):
+    """Token usage totals for one client on one UTC day"""
+    day: str
+    client_id: str
+    tasks: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    total_tokens: int = 0 
\ No newline at end of file
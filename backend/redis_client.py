@@ -0,0 +1,23 @@
+from typing import Dict
+
+import redis
+
+# One client, and so one connection pool, per URL for the whole process
+_clients: Dict[str, redis.Redis] = {}
+
+
+def get_redis(url: str) -> redis.Redis:
+    """
+    Shared Redis client for a URL.
+
+    Timeouts are short because every caller treats Redis as best effort and degrades
+    (fails open, skips a cache) instead of holding up a request.
+    """
+    client = _clients.get(url)
+    if client is None:
+        client = _clients.setdefault(url, redis.Redis.from_url(
+            url,
+            socket_timeout=1,
+            socket_connect_timeout=1,
+        ))
+    return client
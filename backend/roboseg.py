@@ -0,0 +1,23 @@
+import argparse
+
+import ingest
+
+
+def main() -> None:
+    """Command-line entry point: `python roboseg.py <command> ...`."""
+    parser = argparse.ArgumentParser(prog="roboseg", description="Robot Data Segmentation Agent tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help="Segment every video in a dataset directory or manifest, resuming previous runs"
+    )
+    ingest.add_arguments(ingest_parser)
+    ingest_parser.set_defaults(handler=ingest.main)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,9 +18,11 @@ REM Start Redis if it's not already running (assuming it's installed)
 echo Checking Redis...
 REM Add your Redis check/start command here if you have a local Redis installation
 
-REM Start Celery worker
-echo Starting Celery worker...
-start cmd /k "venv\Scripts\activate && celery -A backend.celery_app worker --loglevel=info"
+REM Start one Celery worker per pipeline queue
+echo Starting Celery workers...
+start cmd /k "venv\Scripts\activate && celery -A backend.celery_app worker --loglevel=info -Q io.short,io,io.long,celery --prefetch-multiplier 4 -n io@%%COMPUTERNAME%%"
+start cmd /k "venv\Scripts\activate && celery -A backend.celery_app worker --loglevel=info -Q upload.short,upload,upload.long --prefetch-multiplier 1 -n upload@%%COMPUTERNAME%%"
+start cmd /k "venv\Scripts\activate && celery -A backend.celery_app worker --loglevel=info -Q inference.short,inference,inference.long --prefetch-multiplier 1 -n inference@%%COMPUTERNAME%%"
 
 REM Start FastAPI server
 echo Starting FastAPI server...
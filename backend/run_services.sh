@@ -24,16 +24,20 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
-# Start Celery worker (background)
-echo "Starting Celery worker..."
-celery -A backend.celery_app worker --loglevel=info &
-CELERY_PID=$!
+# Start one Celery worker per pipeline queue (background)
+echo "Starting Celery workers..."
+celery -A backend.celery_app worker --loglevel=info -Q io.short,io,io.long,celery --prefetch-multiplier 4 -n io@%h &
+CELERY_IO_PID=$!
+celery -A backend.celery_app worker --loglevel=info -Q upload.short,upload,upload.long --prefetch-multiplier 1 -n upload@%h &
+CELERY_UPLOAD_PID=$!
+celery -A backend.celery_app worker --loglevel=info -Q inference.short,inference,inference.long --prefetch-multiplier 1 -n inference@%h &
+CELERY_INFERENCE_PID=$!
 
 # Start FastAPI server (foreground)
 echo "Starting FastAPI server..."
 python main.py
 
-# Clean up Celery worker when FastAPI server stops
-kill $CELERY_PID
+# Clean up Celery workers when FastAPI server stops
+kill $CELERY_IO_PID $CELERY_UPLOAD_PID $CELERY_INFERENCE_PID
 
 echo "Services stopped" 
\ No newline at end of file
@@ -0,0 +1,78 @@
+from typing import Dict, Any, Optional
+
+import config
+
+# Approximate Gemini token cost of video input, per the API's media tokenization
+VIDEO_TOKENS_PER_FRAME = {"low": 66, "medium": 258, "high": 258}
+AUDIO_TOKENS_PER_SECOND = 32
+# Allowance for the text prompt sent alongside the video
+PROMPT_TOKENS = 1000
+DEFAULT_FPS = 1.0
+DEFAULT_MEDIA_RESOLUTION = "medium"
+
+# How the chosen sampling relates to the token budget, reported in "budget_status"
+WITHIN_BUDGET = "within_budget"
+# Even the lowest sampling allowed (low resolution at SAMPLING_MIN_FPS), or the explicit settings, cost more
+OVER_BUDGET = "over_budget"
+# The duration is unknown (e.g. YouTube URLs, which are never downloaded), so the budget could not be applied
+UNKNOWN_DURATION = "unknown_duration"
+
+
+def estimate_prompt_tokens(duration_seconds: float, fps: float, media_resolution: str) -> int:
+    """Expected prompt tokens for a video of the given duration at the given sampling."""
+    per_second = fps * VIDEO_TOKENS_PER_FRAME[media_resolution] + AUDIO_TOKENS_PER_SECOND
+    return int(duration_seconds * per_second) + PROMPT_TOKENS
+
+
+def choose_sampling(settings: Optional[Dict[str, Any]], duration_seconds: Optional[float]) -> Dict[str, Any]:
+    """
+    Resolve the frame rate and media resolution for one task.
+
+    Explicit fps/media_resolution always win. Otherwise, when a token budget is set
+    (per task or SAMPLING_DEFAULT_TOKEN_BUDGET) and the duration is known, the best
+    sampling that fits is picked: default resolution at 1 fps if affordable, else low
+    resolution (4x cheaper per frame) at the highest frame rate the budget allows.
+    Timestamps matter more than pixel detail for segmentation, so frame rate is
+    the last thing given up.
+
+    "budget_status" says whether the estimate fits the budget, does not fit it, or
+    could not be computed because the duration is unknown; it is None without a budget.
+    """
+    settings = settings or {}
+    fps = settings.get("fps")
+    media_resolution = settings.get("media_resolution")
+    token_budget = settings.get("token_budget") or config.SAMPLING_DEFAULT_TOKEN_BUDGET or None
+
+    if token_budget and duration_seconds and (fps is None or media_resolution is None):
+        video_budget_per_second = (token_budget - PROMPT_TOKENS) / duration_seconds - AUDIO_TOKENS_PER_SECOND
+        candidates = [media_resolution] if media_resolution else [DEFAULT_MEDIA_RESOLUTION, "low"]
+        for resolution in candidates:
+            affordable_fps = video_budget_per_second / VIDEO_TOKENS_PER_FRAME[resolution]
+            target_fps = fps if fps is not None else DEFAULT_FPS
+            if affordable_fps >= target_fps or resolution == candidates[-1]:
+                media_resolution = resolution
+                if fps is None:
+                    fps = min(DEFAULT_FPS, max(config.SAMPLING_MIN_FPS, affordable_fps))
+                break
+
+    chosen = {
+        "fps": fps,
+        "media_resolution": media_resolution,
+        "token_budget": token_budget,
+        "estimated_prompt_tokens": None,
+        "budget_status": None,
+    }
+    if duration_seconds:
+        chosen["estimated_prompt_tokens"] = estimate_prompt_tokens(
+            duration_seconds,
+            fps or DEFAULT_FPS,
+            media_resolution or DEFAULT_MEDIA_RESOLUTION
+        )
+    if token_budget:
+        if chosen["estimated_prompt_tokens"] is None:
+            chosen["budget_status"] = UNKNOWN_DURATION
+        elif chosen["estimated_prompt_tokens"] > token_budget:
+            chosen["budget_status"] = OVER_BUDGET
+        else:
+            chosen["budget_status"] = WITHIN_BUDGET
+    return chosen
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, Any, List, Optional
+
+import redis
+from cachetools import LRUCache
+
+import config
+from redis_client import get_redis
+from celery_app import celery_app
+
+# Pub/sub channel workers publish task state changes on
+EVENTS_CHANNEL = "roboseg:task-events"
+
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+_lock = threading.Lock()
+# task_id -> {"status", "result", "error", "checked_at"}; terminal entries never need refreshing
+_entries: LRUCache = LRUCache(maxsize=config.STATUS_CACHE_SIZE)
+# task_id -> Celery task id from the .task_info mapping file (differs only for tasks queued before the pipeline split)
+_celery_ids: LRUCache = LRUCache(maxsize=config.STATUS_CACHE_SIZE)
+
+_listener: Optional[threading.Thread] = None
+
+
+def _entry(status: str, result: Any = None, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Normalise a task state into what the API reports.
+
+    The pipeline signals failures by returning {"error": ...}, which Celery records
+    as SUCCESS; report those as FAILURE so status and result always agree.
+    """
+    if status == "SUCCESS" and isinstance(result, dict) and "error" in result:
+        return {"status": "FAILURE", "result": None, "error": result["error"], "checked_at": time.time()}
+    if status == "FAILURE" and error is None:
+        error = str(result) if result is not None else "Task failed"
+        result = None
+    return {"status": status, "result": result, "error": error, "checked_at": time.time()}
+
+
+def publish(task_id: str, status: str, result: Any = None) -> None:
+    """Called by workers: announce a state change so API processes can update their cache without polling."""
+    message = {"task_id": task_id, "status": status, "result": result}
+    try:
+        get_redis(config.STATUS_REDIS_URL).publish(EVENTS_CHANNEL, json.dumps(message))
+    except (redis.RedisError, TypeError, ValueError) as e:
+        print(f"Warning: failed to publish status {status} for task {task_id}: {str(e)}")
+
+
+def _apply_event(raw: bytes) -> None:
+    event = json.loads(raw)
+    entry = _entry(event["status"], event.get("result"))
+    with _lock:
+        _entries[event["task_id"]] = entry
+
+
+def _listen_forever() -> None:
+    while True:
+        try:
+            # A dedicated connection without the shared client's 1s read timeout, since listen() blocks
+            pubsub = redis.Redis.from_url(config.STATUS_REDIS_URL).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(EVENTS_CHANNEL)
+            print(f"Listening for task status notifications on {EVENTS_CHANNEL}")
+            for message in pubsub.listen():
+                try:
+                    _apply_event(message["data"])
+                except (ValueError, KeyError) as e:
+                    print(f"Warning: ignoring malformed task status notification: {str(e)}")
+        except redis.RedisError as e:
+            # Missed notifications are covered by the periodic backend refresh of non-terminal entries
+            print(f"Task status listener disconnected, reconnecting in 5s: {str(e)}")
+            time.sleep(5)
+
+
+def start_listener() -> None:
+    """Start the background thread that applies worker notifications to the in-process cache."""
+    global _listener
+    if _listener is None or not _listener.is_alive():
+        _listener = threading.Thread(target=_listen_forever, name="task-status-listener", daemon=True)
+        _listener.start()
+
+
+def _celery_id(task_id: str) -> str:
+    with _lock:
+        celery_task_id = _celery_ids.get(task_id)
+    if celery_task_id is not None:
+        return celery_task_id
+
+    celery_task_id = task_id
+    mapping_path = os.path.join(config.UPLOAD_DIR, f"{task_id}.task_info")
+    if os.path.exists(mapping_path):
+        try:
+            with open(mapping_path, "r") as f:
+                celery_task_id = json.loads(f.read()).get("celery_task_id") or task_id
+        except Exception as e:
+            print(f"Error reading task mapping file: {str(e)}")
+    with _lock:
+        _celery_ids[task_id] = celery_task_id
+    return celery_task_id
+
+
+def _fetch_from_backend(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Read task metadata for many tasks from the result backend in a single round trip."""
+    celery_ids = [_celery_id(task_id) for task_id in task_ids]
+    backend = celery_app.backend
+    if hasattr(backend, "client") and hasattr(backend, "get_key_for_task"):
+        raw_metas = backend.client.mget([backend.get_key_for_task(celery_id) for celery_id in celery_ids])
+        metas = [backend.decode_result(raw) if raw else {"status": "PENDING", "result": None} for raw in raw_metas]
+    else:
+        metas = [backend.get_task_meta(celery_id) for celery_id in celery_ids]
+
+    # Failure metas already carry the exception rebuilt by the backend
+    return {task_id: _entry(meta["status"], meta.get("result")) for task_id, meta in zip(task_ids, metas)}
+
+
+def get_many(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Current state of many tasks.
+
+    Terminal states are served from the in-process cache forever; other states
+    are served from the cache while younger than STATUS_REFRESH_SECONDS, so at most
+    one backend read per task per interval happens however often clients poll.
+    Everything else is fetched with one MGET.
+    """
+    now = time.time()
+    found: Dict[str, Dict[str, Any]] = {}
+    stale: List[str] = []
+    with _lock:
+        for task_id in dict.fromkeys(task_ids):
+            entry = _entries.get(task_id)
+            if entry and (entry["status"] in TERMINAL_STATES or now - entry["checked_at"] < config.STATUS_REFRESH_SECONDS):
+                found[task_id] = entry
+            else:
+                stale.append(task_id)
+
+    if stale:
+        fetched = _fetch_from_backend(stale)
+        with _lock:
+            for task_id, entry in fetched.items():
+                current = _entries.get(task_id)
+                # A notification may have delivered a newer state while we were reading the backend
+                if current and current["status"] in TERMINAL_STATES and entry["status"] not in TERMINAL_STATES:
+                    entry = current
+                elif current and current["status"] != "PENDING" and entry["status"] == "PENDING":
+                    entry = dict(current, checked_at=entry["checked_at"])
+                _entries[task_id] = entry
+                found[task_id] = entry
+    return found
+
+
+def get(task_id: str) -> Dict[str, Any]:
+    """Current state of one task."""
+    return get_many([task_id])[task_id]
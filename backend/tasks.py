@@ -1,181 +1,33 @@
 import os
 import json
 import asyncio
+import traceback
 import requests
 from typing import Dict, Any, Optional
 import mimetypes  # For guessing MIME types if needed for other URLs before download
-import re         # For YouTube URL detection
 
 # Updated imports for Google Gen AI SDK
 from google import genai
 from google.genai import types # For types.GenerateContentConfig, types.FileState, etc.
 from google.genai import errors as genai_errors # For specific API error handling
 from google.genai.types import GenerateContentConfig, Content, Part, FileData
-from google.genai.types import File as GenAIFile          
+from celery import chain
+import redis
 
 from celery_app import celery_app # Assuming these are your local modules
 import config
+import admission
+import url_cache
+import video_probe
+import sampling
+import usage
+import task_status
+from redis_client import get_redis
+from url_cache import is_youtube_url
 from models import ActionSegment, SegmentationResponse
 
 
-def is_youtube_url(url):
-    if not url:
-        return False
-    youtube_regex = (
-        r'(https?://)?(www\.)?'
-        '(youtube|youtu|youtube-nocookie)\.(com|be)/'
-        '(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
-    return re.match(youtube_regex, url)
-
-
-async def _process_video_async(
-    task_id: str,
-    video_path: Optional[str] = None,
-    video_url: Optional[str] = None
-) -> Dict[str, Any]:
-    client: Optional[genai.Client] = None
-    downloaded_file_path: Optional[str] = None
-    api_response_text: Optional[str] = None
-    file_deleted_in_exception_block = False
-    video_model_input: Optional[genai.files.File | types.Part] = None
-    gemini_file_name_for_cleanup: Optional[str] = None
-
-    try:
-        if not config.GEMINI_API_KEY:
-            return {"error": "GEMINI_API_KEY not configured."}
-        
-        client = genai.Client(api_key=config.GEMINI_API_KEY)
-
-        if video_url and is_youtube_url(video_url):
-            print(f"Processing as direct YouTube URL: {video_url}")
-            try:
-                video_model_input = types.Part(
-                    file_data=types.FileData(file_uri=video_url)
-                )
-                print(f"Successfully created Part for YouTube URL: {video_url}")
-            except Exception as e:
-                return {"error": f"Failed to create Part from YouTube URL '{video_url}': {str(e)}"}
-
-        elif video_path or video_url:
-            current_file_path = video_path
-
-            if video_url and not current_file_path:
-                print(f"Downloading video from general URL: {video_url}")
-                try:
-                    file_extension = os.path.splitext(video_url.split('?')[0])[-1] or '.mp4'
-                    if not file_extension.startswith('.'):
-                        file_extension = '.' + file_extension
-                    file_name = f"{task_id}{file_extension}"
-
-                    upload_dir = getattr(config, 'UPLOAD_DIR', 'uploads')
-                    if not os.path.exists(upload_dir):
-                        os.makedirs(upload_dir, exist_ok=True)
-                    downloaded_file_path = os.path.join(upload_dir, file_name)
-
-                    response = requests.get(video_url, stream=True, timeout=60)
-                    response.raise_for_status()
-                    content_type = response.headers.get('content-type', '')
-                    if not content_type.startswith('video/'):
-                        if os.path.exists(downloaded_file_path): os.remove(downloaded_file_path)
-                        raise ValueError(f"URL does not point to a video file. Content-Type: {content_type}")
-                    with open(downloaded_file_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    current_file_path = downloaded_file_path
-                    print(f"Video downloaded successfully to {current_file_path}")
-                except requests.RequestException as e:
-                    return {"error": f"Failed to download video from URL: {str(e)}"}
-                except ValueError as e:
-                    return {"error": str(e)}
-                except Exception as e:
-                    if 'downloaded_file_path' in locals() and os.path.exists(downloaded_file_path):
-                        try:
-                            os.remove(downloaded_file_path)
-                        except OSError: pass
-                    return {"error": f"Error processing video URL for download: {str(e)}"}
-
-            if not current_file_path:
-                return {"error": "Video source (file path or URL) not available or failed to prepare."}
-            if not os.path.exists(current_file_path):
-                return {"error": f"Video file not found at {current_file_path}"}
-
-            print(f"Uploading file to Gemini File API: {current_file_path}")
-            try:
-                uploaded_file_response = await client.aio.files.upload(file=current_file_path)
-                gemini_file_name_for_cleanup = uploaded_file_response.name
-
-                file_for_model = uploaded_file_response
-                max_retries = 30 
-                retry_delay_seconds = 20
-                retry_count = 0
-
-                while file_for_model.state != types.FileState.ACTIVE and retry_count < max_retries:
-                    current_state_obj = file_for_model.state
-                    current_state_name = ""
-                    current_state_value_for_log = ""
-
-                    if isinstance(current_state_obj, int):
-                        try:
-                            current_state_name = types.FileState(current_state_obj).name
-                            current_state_value_for_log = current_state_obj
-                        except ValueError:
-                            current_state_name = f"UNKNOWN_INT_STATE_{current_state_obj}"
-                            current_state_value_for_log = current_state_obj
-                    elif hasattr(current_state_obj, 'name'):
-                        current_state_name = current_state_obj.name
-                        current_state_value_for_log = current_state_obj.value if hasattr(current_state_obj, 'value') else str(current_state_obj)
-                    else:
-                        current_state_name = str(current_state_obj)
-                        current_state_value_for_log = str(current_state_obj)
-
-                    print(f"File not active, current state: {current_state_name} ({current_state_value_for_log}). Retrying {retry_count+1}/{max_retries} in {retry_delay_seconds}s...")
-                    await asyncio.sleep(retry_delay_seconds)
-                    file_for_model = await client.aio.files.get(name=gemini_file_name_for_cleanup)
-                    retry_count += 1
-                    print(f"Polled file details (Try {retry_count}): {file_for_model}")
-                    if hasattr(file_for_model, 'error') and file_for_model.error:
-                        print(f"!!! File processing error reported by API (Try {retry_count}): {file_for_model.error}")
-
-                if file_for_model.state != types.FileState.ACTIVE:
-                    current_state_obj_final = file_for_model.state
-                    current_state_name_final = types.FileState(current_state_obj_final).name if isinstance(current_state_obj_final, int) else (current_state_obj_final.name if hasattr(current_state_obj_final, 'name') else str(current_state_obj_final))
-                    current_state_value_final = current_state_obj_final.value if hasattr(current_state_obj_final, 'value') else current_state_obj_final
-
-                    file_error_details = ""
-                    if hasattr(file_for_model, 'error') and file_for_model.error:
-                        file_error_details = f" Reported API Error: {file_for_model.error}"
-
-                    if client and gemini_file_name_for_cleanup:
-                        try:
-                            await client.aio.files.delete(name=gemini_file_name_for_cleanup)
-                            print(f"Cleaned up Gemini file {gemini_file_name_for_cleanup} due to non-ACTIVE state.")
-                            file_deleted_in_exception_block = True
-                        except Exception as del_e:
-                            print(f"Warning: Failed to delete Gemini file {gemini_file_name_for_cleanup} after non-ACTIVE state: {str(del_e)}")
-                    return {"error": f"File upload to Gemini failed to become ACTIVE. Final state: {current_state_obj_final}{file_error_details}"}
-
-                active_state_name = file_for_model.state.name if hasattr(file_for_model.state, 'name') else types.FileState(file_for_model.state).name
-                print(f"File is ACTIVE ({active_state_name}) on Gemini. Proceeding with content generation.")
-                print(f"Active file details: URI='{file_for_model.uri}', MimeType='{file_for_model.mime_type}'")
-
-                video_model_input = file_for_model
-
-            except Exception as e:
-                if client and gemini_file_name_for_cleanup and not file_deleted_in_exception_block:
-                    try:
-                        await client.aio.files.delete(name=gemini_file_name_for_cleanup)
-                        print(f"Cleaned up Gemini file {gemini_file_name_for_cleanup} due to an exception during upload/polling.")
-                        file_deleted_in_exception_block = True
-                    except Exception as del_e:
-                        print(f"Warning: Failed to delete Gemini file {gemini_file_name_for_cleanup} after exception: {str(del_e)}")
-                return {"error": f"Failed during File API processing for '{current_file_path}': {str(e)}"}
-        else:
-            return {"error": "Video source (file path or URL) not provided."}
-
-        if not video_model_input:
-            return {"error": "Video input for the model could not be prepared."}
-
-        prompt = """You are an expert in analyzing robotic task videos. Your objective is to extract key, discrete actions performed by the robot(s) and their corresponding start and end timestamps from the provided video. The video may incorporate views from multiple cameras, including stationary and robot wrist-mounted cameras, showing robotic manipulation tasks.
+SEGMENTATION_PROMPT = """You are an expert in analyzing robotic task videos. Your objective is to extract key, discrete actions performed by the robot(s) and their corresponding start and end timestamps from the provided video. The video may incorporate views from multiple cameras, including stationary and robot wrist-mounted cameras, showing robotic manipulation tasks.
 
         Focus on tangible, goal-oriented actions performed by the robot(s), such as picking up objects, placing objects, manipulating tools, moving to specific locations, or interacting with its environment. Avoid describing continuous background activity or minute, inconsequential movements unless they are part of a larger, nameable action.
 
@@ -219,147 +71,541 @@ async def _process_video_async(
             }
         ]
         }"""
-        response_schema_for_config = {
-            "type": "object",
-            "properties": {
-                "action_segments": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "action":      {"type": "string"},
-                            "start_time":  {"type": "string"},
-                            "end_time":    {"type": "string"}
-                        },
-                        "required": ["action", "start_time", "end_time"]
-                    }
-                }
-            },
-            "required": ["action_segments"]
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action_segments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "action":      {"type": "string"},
+                    "start_time":  {"type": "string"},
+                    "end_time":    {"type": "string"}
+                },
+                "required": ["action", "start_time", "end_time"]
+            }
         }
+    },
+    "required": ["action_segments"]
+}
+
+
+def _cached_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Segmentation result from a URL cache entry, dropping the local video path if that file is gone."""
+    result = dict(entry["result"])
+    video_path = result.get("downloaded_video_path")
+    if video_path and not os.path.exists(os.path.join(config.UPLOAD_DIR, os.path.basename(video_path))):
+        result["downloaded_video_path"] = None
+    # No tokens were spent on a cache hit
+    result["usage"] = None
+    return result
+
+
+def _cache_settings(job: Dict[str, Any]) -> Dict[str, Any]:
+    """What a segmentation depends on besides the video itself: the model and the requested sampling."""
+    requested = job.get("sampling_settings") or {}
+    return {
+        "model": config.GEMINI_MODEL_NAME,
+        "fps": requested.get("fps"),
+        "media_resolution": requested.get("media_resolution"),
+        "token_budget": requested.get("token_budget") or config.SAMPLING_DEFAULT_TOKEN_BUDGET or None,
+    }
+
+
+def _file_state_name(state_obj) -> str:
+    if isinstance(state_obj, int):
+        try:
+            return types.FileState(state_obj).name
+        except ValueError:
+            return f"UNKNOWN_INT_STATE_{state_obj}"
+    if hasattr(state_obj, 'name'):
+        return state_obj.name
+    return str(state_obj)
+
+
+def _is_transient(exc: Exception) -> bool:
+    """Errors worth retrying the current stage for: network failures, 5xx and rate limiting."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None and exc.response.status_code >= 500:
+        return True
+    if isinstance(exc, genai_errors.ServerError):
+        return True
+    if isinstance(exc, genai_errors.ClientError) and getattr(exc, 'code', None) == 429:
+        return True
+    return False
+
+
+def new_job(
+    task_id: str,
+    video_path: Optional[str] = None,
+    video_url: Optional[str] = None,
+    client_id: Optional[str] = None,
+    sampling_settings: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Initial state handed from stage to stage through the pipeline.
 
+    Every stage takes the job dict and returns an updated copy. A stage that fails
+    sets "error"; a stage that already has the final segmentation (e.g. from the URL
+    cache) sets "result". Either way the remaining stages pass the job through
+    untouched until postprocessing.
+    """
+    return {
+        "task_id": task_id,
+        "video_path": video_path,
+        "video_url": video_url,
+        "youtube": bool(video_url and is_youtube_url(video_url)),
+        "client_id": client_id,
+        "sampling_settings": sampling_settings or {},
+        "local_path": video_path,
+        "downloaded_file_path": None,
+        "remote_validators": {},
+        "probe": None,
+        "gemini_file_name": None,
+        "gemini_file_uri": None,
+        "gemini_mime_type": None,
+        "cache_hit": False,
+        "result": None,
+        "error": None,
+    }
+
+
+def _fetch(job: Dict[str, Any]) -> Dict[str, Any]:
+    video_url = job["video_url"]
+    task_id = job["task_id"]
+
+    if job["youtube"]:
+        # A YouTube video id always refers to the same video, so a cached result needs no revalidation
+        cached_entry = url_cache.get_entry(video_url, _cache_settings(job))
+        if cached_entry:
+            print(f"URL cache hit for YouTube video {url_cache.cache_key(video_url, _cache_settings(job))}, skipping inference")
+            return dict(job, result=_cached_result(cached_entry), cache_hit=True)
+        print(f"Processing as direct YouTube URL: {video_url}")
+        return job
+
+    if job["local_path"]:
+        return job
+    if not video_url:
+        return dict(job, error="Video source (file path or URL) not provided.")
+
+    print(f"Downloading video from general URL: {video_url}")
+    file_extension = os.path.splitext(video_url.split('?')[0])[-1] or '.mp4'
+    if not file_extension.startswith('.'):
+        file_extension = '.' + file_extension
+    file_name = f"{task_id}{file_extension}"
+
+    upload_dir = getattr(config, 'UPLOAD_DIR', 'uploads')
+    if not os.path.exists(upload_dir):
+        os.makedirs(upload_dir, exist_ok=True)
+    downloaded_file_path = os.path.join(upload_dir, file_name)
+
+    # Conditional GET: an unchanged object answers 304 and nothing is downloaded
+    cached_entry = url_cache.get_entry(video_url, _cache_settings(job))
+    response = requests.get(
+        video_url,
+        stream=True,
+        timeout=60,
+        headers=url_cache.conditional_headers(cached_entry)
+    )
+    if cached_entry and url_cache.is_unchanged(cached_entry, response.status_code, response.headers):
+        response.close()
+        print(f"URL cache hit for {video_url} (HTTP {response.status_code}), skipping download and inference")
+        return dict(job, result=_cached_result(cached_entry), cache_hit=True)
+    response.raise_for_status()
+    content_type = response.headers.get('content-type', '')
+    if not content_type.startswith('video/'):
+        return dict(job, error=f"URL does not point to a video file. Content-Type: {content_type}")
+    try:
+        with open(downloaded_file_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(downloaded_file_path):
+            try:
+                os.remove(downloaded_file_path)
+            except OSError: pass
+        raise
+    print(f"Video downloaded successfully to {downloaded_file_path}")
+    # Only the task count was reserved at submission; the download now counts against the in-flight bytes
+    admission.add_bytes(task_id, os.path.getsize(downloaded_file_path))
+    return dict(
+        job,
+        local_path=downloaded_file_path,
+        downloaded_file_path=downloaded_file_path,
+        remote_validators=url_cache.validators_from_headers(response.headers)
+    )
+
+
+def _preprocess(job: Dict[str, Any]) -> Dict[str, Any]:
+    if job["youtube"]:
+        return job
+    current_file_path = job["local_path"]
+    if not current_file_path:
+        return dict(job, error="Video source (file path or URL) not available or failed to prepare.")
+    if not os.path.exists(current_file_path):
+        return dict(job, error=f"Video file not found at {current_file_path}")
+    if os.path.getsize(current_file_path) == 0:
+        return dict(job, error=f"Video file at {current_file_path} is empty")
+    # Probe once; later stages read the metadata from the job
+    probe = job.get("probe") or video_probe.probe_video(current_file_path)
+    print(f"Probed {current_file_path}: {probe}")
+    return dict(job, probe=probe)
+
+
+def _route_remaining_stages(task, video_class: str) -> None:
+    """
+    Send the rest of this job's chain to the queues of its duration class.
 
-        model_name = getattr(config, 'GEMINI_MODEL_NAME', 'gemini-2.0-flash')
-        
-        print(f"Generating content with model: {model_name}")
-        # 1. Build the video Part (works for both File API uploads and YouTube URLs)
-        if isinstance(video_model_input, GenAIFile):
-            video_part = Part.from_uri(
-                file_uri=video_model_input.uri,
-                mime_type=video_model_input.mime_type
-            )
-        elif isinstance(video_model_input, Part):
-            video_part = video_model_input            # YouTube branch already gave us a Part
-        else:
-            return {"error": "Unsupported video_model_input type."}
-
-        # 2. One Content that holds BOTH video + prompt
-        user_message = Content(
-            parts=[
-                video_part,                            # put the video first
-                Part(text=prompt)                      # then the instructions
-            ]
-        )
+    request.chain holds the remaining stage signatures; an explicit queue option
+    takes precedence over task_routes when the next stage is published.
+    """
+    for stage in task.request.chain or []:
+        route = celery_app.conf.task_routes.get(stage["task"])
+        if route:
+            stage.setdefault("options", {})["queue"] = video_probe.queue_for(route["queue"], video_class)
+
+
+async def _upload_and_activate(job: Dict[str, Any]) -> Dict[str, Any]:
+    if job["youtube"]:
+        return job
 
-        # 3. Generation config (newer class name)
-        gen_cfg = GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=response_schema_for_config
+    current_file_path = job["local_path"]
+    client = genai.Client(api_key=config.GEMINI_API_KEY)
+    gemini_file_name: Optional[str] = None
+
+    print(f"Uploading file to Gemini File API: {current_file_path}")
+    try:
+        uploaded_file_response = await client.aio.files.upload(file=current_file_path)
+        gemini_file_name = uploaded_file_response.name
+
+        file_for_model = uploaded_file_response
+        max_retries = 30
+        retry_delay_seconds = 20
+        retry_count = 0
+
+        while file_for_model.state != types.FileState.ACTIVE and retry_count < max_retries:
+            current_state_name = _file_state_name(file_for_model.state)
+            print(f"File not active, current state: {current_state_name}. Retrying {retry_count+1}/{max_retries} in {retry_delay_seconds}s...")
+            await asyncio.sleep(retry_delay_seconds)
+            file_for_model = await client.aio.files.get(name=gemini_file_name)
+            retry_count += 1
+            print(f"Polled file details (Try {retry_count}): {file_for_model}")
+            if hasattr(file_for_model, 'error') and file_for_model.error:
+                print(f"!!! File processing error reported by API (Try {retry_count}): {file_for_model.error}")
+    except Exception:
+        # The stage may be retried; don't leave the half-processed upload behind
+        if gemini_file_name:
+            try:
+                await client.aio.files.delete(name=gemini_file_name)
+                print(f"Cleaned up Gemini file {gemini_file_name} due to an exception during upload/polling.")
+            except Exception as del_e:
+                print(f"Warning: Failed to delete Gemini file {gemini_file_name} after exception: {str(del_e)}")
+        raise
+
+    if file_for_model.state != types.FileState.ACTIVE:
+        file_error_details = ""
+        if hasattr(file_for_model, 'error') and file_for_model.error:
+            file_error_details = f" Reported API Error: {file_for_model.error}"
+        # Postprocessing deletes the Gemini file
+        return dict(
+            job,
+            gemini_file_name=gemini_file_name,
+            error=f"File upload to Gemini failed to become ACTIVE. Final state: {file_for_model.state}{file_error_details}"
         )
 
-        # 4. Call the model
-        api_response = await client.aio.models.generate_content(
-            model=model_name,
-            contents=[user_message],                  # list with ONE valid Content
-            config=gen_cfg                 # ← use generation_config
+    print(f"File is ACTIVE ({_file_state_name(file_for_model.state)}) on Gemini. Proceeding with content generation.")
+    print(f"Active file details: URI='{file_for_model.uri}', MimeType='{file_for_model.mime_type}'")
+    return dict(
+        job,
+        gemini_file_name=gemini_file_name,
+        gemini_file_uri=file_for_model.uri,
+        gemini_mime_type=file_for_model.mime_type
+    )
+
+
+async def _generate(job: Dict[str, Any]) -> Dict[str, Any]:
+    client = genai.Client(api_key=config.GEMINI_API_KEY)
+    model_name = config.GEMINI_MODEL_NAME
+
+    # Frame rate and resolution: explicit per-task values, or chosen from the token budget
+    probe = job.get("probe")
+    chosen_sampling = sampling.choose_sampling(
+        job.get("sampling_settings"),
+        video_probe.expected_duration_seconds(probe) if probe else None
+    )
+    print(f"Video sampling for task {job['task_id']}: {chosen_sampling}")
+    if chosen_sampling["budget_status"] in (sampling.OVER_BUDGET, sampling.UNKNOWN_DURATION):
+        print(f"Warning: token budget of {chosen_sampling['token_budget']} not met for task {job['task_id']}: {chosen_sampling['budget_status']}")
+    video_metadata = types.VideoMetadata(fps=chosen_sampling["fps"]) if chosen_sampling["fps"] else None
+
+    # 1. Build the video Part (works for both File API uploads and YouTube URLs)
+    if job["youtube"]:
+        video_part = Part(file_data=FileData(file_uri=job["video_url"]), video_metadata=video_metadata)
+    elif job["gemini_file_uri"]:
+        video_part = Part(
+            file_data=FileData(file_uri=job["gemini_file_uri"], mime_type=job["gemini_mime_type"]),
+            video_metadata=video_metadata
         )
-        print("Content generation complete. Response received from Gemini.")
-        
-        if not api_response.candidates:
-            return {"error": "Gemini response had no candidates."}
-        
-        try:
-            api_response_text = api_response.text
-        except ValueError:
-            finish_reason_val = "UNKNOWN"
-            if api_response.candidates and hasattr(api_response.candidates[0], 'finish_reason'):
-                 finish_reason_val = api_response.candidates[0].finish_reason.name if hasattr(api_response.candidates[0].finish_reason, 'name') else str(api_response.candidates[0].finish_reason)
-
-            safety_ratings_val = "UNKNOWN"
-            if api_response.candidates and hasattr(api_response.candidates[0], 'safety_ratings') and api_response.candidates[0].safety_ratings:
-                safety_ratings_val = str(api_response.candidates[0].safety_ratings)
-            
-            print(f"Gemini API response was blocked or did not return text. Finish Reason: {finish_reason_val}")
-            print(f"Safety Ratings: {safety_ratings_val}")
-            prompt_feedback = api_response.prompt_feedback if hasattr(api_response, 'prompt_feedback') else "N/A"
-            print(f"Prompt Feedback: {prompt_feedback}")
-
-            return {"error": f"Gemini API response was blocked or did not return text. Finish Reason: {finish_reason_val}"}
-
-        print(f"Gemini response text: {api_response_text}")
-        result_json = json.loads(api_response_text)
-        validated_result = SegmentationResponse(**result_json).model_dump()
+    else:
+        return dict(job, error="Video input for the model could not be prepared.")
+
+    # 2. One Content that holds BOTH video + prompt
+    user_message = Content(
+        parts=[
+            video_part,                            # put the video first
+            Part(text=SEGMENTATION_PROMPT)         # then the instructions
+        ]
+    )
+
+    # 3. Generation config (newer class name)
+    gen_cfg = GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=RESPONSE_SCHEMA,
+        media_resolution=f"MEDIA_RESOLUTION_{chosen_sampling['media_resolution'].upper()}" if chosen_sampling["media_resolution"] else None
+    )
+
+    # 4. Call the model
+    print(f"Generating content with model: {model_name}")
+    api_response = await client.aio.models.generate_content(
+        model=model_name,
+        contents=[user_message],                  # list with ONE valid Content
+        config=gen_cfg
+    )
+    print("Content generation complete. Response received from Gemini.")
+
+    # Tokens are billed even if the response turns out to be unusable, so record them first
+    token_counts = usage.token_counts(api_response.usage_metadata)
+    print(f"Token usage for task {job['task_id']}: {token_counts}")
+    usage.record(job.get("client_id"), token_counts)
+
+    if not api_response.candidates:
+        return dict(job, error="Gemini response had no candidates.")
 
-        # Add downloaded_file_path to the result if available
-        if 'downloaded_file_path' in locals() and downloaded_file_path and os.path.exists(downloaded_file_path):
-            # Add the file path relative to the server root for serving
-            file_name = os.path.basename(downloaded_file_path)
-            validated_result["downloaded_video_path"] = f"uploads/{file_name}"
+    try:
+        api_response_text = api_response.text
+    except ValueError:
+        finish_reason_val = "UNKNOWN"
+        if api_response.candidates and hasattr(api_response.candidates[0], 'finish_reason'):
+             finish_reason_val = api_response.candidates[0].finish_reason.name if hasattr(api_response.candidates[0].finish_reason, 'name') else str(api_response.candidates[0].finish_reason)
 
-        return validated_result
-        
+        safety_ratings_val = "UNKNOWN"
+        if api_response.candidates and hasattr(api_response.candidates[0], 'safety_ratings') and api_response.candidates[0].safety_ratings:
+            safety_ratings_val = str(api_response.candidates[0].safety_ratings)
+
+        print(f"Gemini API response was blocked or did not return text. Finish Reason: {finish_reason_val}")
+        print(f"Safety Ratings: {safety_ratings_val}")
+        prompt_feedback = api_response.prompt_feedback if hasattr(api_response, 'prompt_feedback') else "N/A"
+        print(f"Prompt Feedback: {prompt_feedback}")
+
+        return dict(job, error=f"Gemini API response was blocked or did not return text. Finish Reason: {finish_reason_val}")
+
+    print(f"Gemini response text: {api_response_text}")
+    try:
+        result_json = json.loads(api_response_text)
     except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: {str(e)}. Response text was: '{api_response_text if api_response_text is not None else 'N/A'}'")
-        return {"error": f"Failed to parse Gemini response as JSON: {str(e)}"}
-    except genai_errors.APIError as e:
-        import traceback
-        print(f"A GenAI API error occurred: {str(e)}\n{traceback.format_exc()}")
-        if client and gemini_file_name_for_cleanup and not file_deleted_in_exception_block:
-            try:
-                await client.aio.files.delete(name=gemini_file_name_for_cleanup)
-                print(f"Cleaned up Gemini file {gemini_file_name_for_cleanup} due to API exception.")
-                file_deleted_in_exception_block = True
-            except Exception as del_e:
-                print(f"Warning: Failed to delete Gemini file {gemini_file_name_for_cleanup} after API exception: {str(del_e)}")
-        return {"error": f"Error processing video (API Error): {str(e)}"}
+        print(f"JSONDecodeError: {str(e)}. Response text was: '{api_response_text}'")
+        return dict(job, error=f"Failed to parse Gemini response as JSON: {str(e)}")
+    validated_result = SegmentationResponse(**result_json, sampling=chosen_sampling, usage=token_counts).model_dump()
+    return dict(job, result=validated_result)
+
+
+async def _delete_gemini_file(gemini_file_name: str) -> None:
+    client = genai.Client(api_key=config.GEMINI_API_KEY)
+    try:
+        await client.aio.files.delete(name=gemini_file_name)
+        print(f"Successfully deleted Gemini file: {gemini_file_name}")
+    except genai_errors.NotFoundError:
+        print(f"Gemini file {gemini_file_name} not found (already deleted or never fully created).")
+    except genai_errors.PermissionDeniedError:
+        print(f"Permission denied attempting to delete Gemini file {gemini_file_name}. It might have been deleted by another process or retained due to ongoing operations.")
     except Exception as e:
-        import traceback
-        print(f"An unexpected error occurred: {str(e)}\n{traceback.format_exc()}")
-        if client and gemini_file_name_for_cleanup and not file_deleted_in_exception_block:
-            try:
-                await client.aio.files.delete(name=gemini_file_name_for_cleanup)
-                print(f"Cleaned up Gemini file {gemini_file_name_for_cleanup} due to unexpected exception.")
-                file_deleted_in_exception_block = True
-            except Exception as del_e:
-                print(f"Warning: Failed to delete Gemini file {gemini_file_name_for_cleanup} after unexpected exception: {str(del_e)}")
-        return {"error": f"Error processing video: {str(e)}"}
-    finally:
-        if client and gemini_file_name_for_cleanup and not file_deleted_in_exception_block:
-            try:
-                print(f"Attempting to delete Gemini file in finally block: {gemini_file_name_for_cleanup}")
-                await client.aio.files.delete(name=gemini_file_name_for_cleanup)
-                print(f"Successfully deleted Gemini file: {gemini_file_name_for_cleanup} in finally block.")
-            except genai_errors.NotFoundError:
-                print(f"Gemini file {gemini_file_name_for_cleanup} not found in finally block (already deleted or never fully created).")
-            except genai_errors.PermissionDeniedError:
-                print(f"Permission denied attempting to delete Gemini file {gemini_file_name_for_cleanup} in finally block. It might have been deleted by another process or retained due to ongoing operations.")
-            except Exception as e:
-                print(f"Warning: Failed to delete Gemini file in finally block '{gemini_file_name_for_cleanup}': {type(e).__name__} - {str(e)}")
-        
-        # Clean up downloaded local file
-        if 'downloaded_file_path' in locals() and downloaded_file_path and os.path.exists(downloaded_file_path):
-            # Don't delete downloaded files from URLs as they're needed for display
-            # We'll let a separate cleanup task handle this later if needed
-            pass
-        
-        # Clean up uploaded video file if it exists
-        if 'video_path' in locals() and video_path and os.path.exists(video_path):
+        print(f"Warning: Failed to delete Gemini file '{gemini_file_name}': {type(e).__name__} - {str(e)}")
+
+
+def _postprocess(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Clean up after the pipeline and produce the task result: the segmentation or {"error": ...}."""
+    try:
+        if job.get("gemini_file_name"):
+            asyncio.run(_delete_gemini_file(job["gemini_file_name"]))
+
+        # Downloaded files from URLs are kept as they're needed for display;
+        # uploaded video files are removed once processed
+        video_path = job.get("video_path")
+        if video_path and os.path.exists(video_path):
             try:
                 os.remove(video_path)
                 print(f"Successfully deleted uploaded video file: {video_path}")
             except Exception as e:
                 print(f"Warning: Failed to delete uploaded video file '{video_path}': {str(e)}")
 
+        if job.get("error"):
+            return {"error": job["error"]}
+        if job.get("result") is None:
+            return {"error": "Pipeline finished without a segmentation result."}
+        if job.get("cache_hit"):
+            return job["result"]
+
+        validated_result = dict(job["result"])
+        # Add the downloaded file path relative to the server root for serving
+        downloaded_file_path = job.get("downloaded_file_path")
+        if downloaded_file_path and os.path.exists(downloaded_file_path):
+            validated_result["downloaded_video_path"] = f"uploads/{os.path.basename(downloaded_file_path)}"
+
+        if job.get("video_url"):
+            url_cache.put_entry(job["video_url"], validated_result, job.get("remote_validators"), _cache_settings(job))
+
+        return validated_result
+    finally:
+        # Free the admission slot whether the task succeeded or not
+        admission.release(job["task_id"])
+
+
+_DELIVERIES_KEY = "roboseg:stage_deliveries:{request_id}:{retries}"
+
+
+def _count_delivery(task) -> int:
+    """
+    How many times this attempt of a stage has been delivered, this one included.
+
+    Stages are acknowledged late and rejected when their worker is lost, so a video
+    that crashes the worker would otherwise be redelivered forever. Retries are
+    counted separately, since they are new attempts rather than redeliveries.
+    Returns 1 when Redis is unavailable, so stages still run.
+    """
+    if task.request.called_directly:
+        return 1
+    key = _DELIVERIES_KEY.format(request_id=task.request.id, retries=task.request.retries)
+    try:
+        pipe = get_redis(config.REDIS_URL).pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 24 * 3600)
+        deliveries, _ = pipe.execute()
+        return deliveries
+    except redis.RedisError as e:
+        print(f"Warning: could not count deliveries of {task.name}: {str(e)}")
+        return 1
+
+
+def _run_stage(task, stage_name: str, job: Dict[str, Any], func) -> Dict[str, Any]:
+    """
+    Run one pipeline stage with per-stage retries.
+
+    Transient failures retry only this stage (the rest of the chain is carried along
+    with the retry). Anything else, running out of retries, or losing the worker
+    STAGE_MAX_DELIVERIES times, is recorded in the job's "error" so postprocessing
+    still runs and cleans up.
+    """
+    if job.get("error") or job.get("result") is not None:
+        return job
+    if not config.GEMINI_API_KEY:
+        return dict(job, error="GEMINI_API_KEY not configured.")
+    deliveries = _count_delivery(task)
+    if deliveries > config.STAGE_MAX_DELIVERIES:
+        print(f"Giving up on {stage_name} for task {job['task_id']}: delivered {deliveries} times, the worker was lost each time")
+        return dict(job, error=f"Error during {stage_name}: the worker processing it was lost {deliveries - 1} times")
+    try:
+        outcome = func(job)
+        if asyncio.iscoroutine(outcome):
+            outcome = asyncio.run(outcome)
+        return outcome
+    except Exception as e:
+        if _is_transient(e) and not task.request.called_directly and task.request.retries < task.max_retries:
+            countdown = config.STAGE_RETRY_BACKOFF_SECONDS * (2 ** task.request.retries)
+            print(f"Transient error in {stage_name} for task {job['task_id']}, retrying stage in {countdown}s: {str(e)}")
+            raise task.retry(exc=e, countdown=countdown)
+        print(f"Error in {stage_name} for task {job['task_id']}: {str(e)}\n{traceback.format_exc()}")
+        if isinstance(e, genai_errors.APIError):
+            return dict(job, error=f"Error processing video (API Error): {str(e)}")
+        return dict(job, error=f"Error during {stage_name}: {str(e)}")
+
+
+# Intermediate stages only hand their job dict to the next stage, so their results are not stored.
+# The soft limit raises inside the stage, so the job fails through postprocessing; together with
+# the prefetch multiplier it bounds the broker visibility timeout (see config).
+_STAGE_OPTIONS = {
+    "bind": True,
+    "ignore_result": True,
+    "max_retries": config.STAGE_MAX_RETRIES,
+    "soft_time_limit": config.STAGE_TIME_LIMIT_SECONDS,
+    "time_limit": config.STAGE_TIME_LIMIT_SECONDS + 60,
+}
+
+
+@celery_app.task(name='tasks.fetch_video', **_STAGE_OPTIONS)
+def fetch_video(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 1 (io queue): resolve the source, serving URL cache hits or downloading the video."""
+    if not job.get("error"):
+        task_status.publish(job["task_id"], "STARTED")
+    job = _run_stage(self, "fetch", job, _fetch)
+    # Until preprocessing probes it, a download is classified by size, so hashing and probing
+    # a short clip does not wait behind long videos in the shared io queue
+    if job.get("downloaded_file_path") and not job.get("error"):
+        _route_remaining_stages(self, video_probe.size_class(os.path.getsize(job["downloaded_file_path"])))
+    return job
+
+
+@celery_app.task(name='tasks.preprocess_video', **_STAGE_OPTIONS)
+def preprocess_video(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 2 (io queue): validate and probe the local video, then route the rest by duration class."""
+    job = _run_stage(self, "preprocess", job, _preprocess)
+    video_class = video_probe.duration_class(job.get("probe"))
+    _route_remaining_stages(self, video_class)
+    return dict(job, duration_class=video_class)
+
+
+@celery_app.task(name='tasks.upload_video_to_gemini', **_STAGE_OPTIONS)
+def upload_video_to_gemini(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 3 (upload queue): upload to the Gemini File API and wait for the file to become ACTIVE."""
+    return _run_stage(self, "upload", job, _upload_and_activate)
+
+
+@celery_app.task(name='tasks.generate_segments', **_STAGE_OPTIONS)
+def generate_segments(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 4 (inference queue): ask Gemini for the action segments."""
+    return _run_stage(self, "generate", job, _generate)
+
+
+@celery_app.task(bind=True, name='tasks.postprocess_result')
+def postprocess_result(self, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 5 (io queue): clean up, cache and return the final result. Always runs, even after errors."""
+    result = _postprocess(job)
+    task_status.publish(job["task_id"], "SUCCESS", result)
+    return result
+
+
+def build_segmentation_pipeline(
+    task_id: str,
+    video_path: Optional[str] = None,
+    video_url: Optional[str] = None,
+    client_id: Optional[str] = None,
+    sampling_settings: Optional[Dict[str, Any]] = None
+):
+    """
+    Chain of stage tasks that segments one video.
+
+    Apply it with `apply_async(task_id=task_id)` so the final stage, whose result is
+    the segmentation, is stored under the application's task id.
+
+    The size of an uploaded file is known here, so its whole chain starts on the queues
+    of the duration class estimated from that size. Preprocessing re-routes the later
+    stages once the video has been probed.
+    """
+    stages = [
+        fetch_video.s(new_job(task_id, video_path, video_url, client_id, sampling_settings)),
+        preprocess_video.s(),
+        upload_video_to_gemini.s(),
+        generate_segments.s(),
+        postprocess_result.s(),
+    ]
+    if video_path and os.path.exists(video_path):
+        video_class = video_probe.size_class(os.path.getsize(video_path))
+        for stage in stages:
+            stage.set(queue=video_probe.queue_for(celery_app.conf.task_routes[stage.task]["queue"], video_class))
+    return chain(*stages)
+
 
 @celery_app.task(bind=True, name='tasks.process_video_for_segmentation')
 def process_video_for_segmentation(
@@ -370,6 +616,13 @@ def process_video_for_segmentation(
 ) -> Dict[str, Any]:
     """
     Celery task that processes a video for segmentation using Google's Gemini API.
-    This is a synchronous wrapper around the async implementation.
+    Runs every stage inside one worker. Kept so messages queued before the pipeline
+    was split still complete; new submissions use build_segmentation_pipeline().
     """
-    return asyncio.run(_process_video_async(task_id, video_path, video_url))
\ No newline at end of file
+    job = new_job(task_id, video_path, video_url)
+    for stage in (fetch_video, preprocess_video, upload_video_to_gemini, generate_segments):
+        try:
+            job = stage(job)
+        except Exception as e:
+            job = dict(job, error=f"Error processing video: {str(e)}")
+    return postprocess_result(job)
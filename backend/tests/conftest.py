@@ -0,0 +1,30 @@
+import os
+import sys
+
+import fakeredis
+import pytest
+
+# Backend modules import each other as top-level modules (import config, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import redis_client
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    """Point every Redis URL the backend uses at one in-memory server, fresh for each test."""
+    server = fakeredis.FakeRedis()
+    urls = (
+        config.REDIS_URL,
+        config.ADMISSION_REDIS_URL,
+        config.URL_CACHE_REDIS_URL,
+        config.PROBE_CACHE_REDIS_URL,
+        config.USAGE_REDIS_URL,
+        config.STATUS_REDIS_URL,
+    )
+    saved = dict(redis_client._clients)
+    redis_client._clients.update({url: server for url in urls})
+    yield server
+    redis_client._clients.clear()
+    redis_client._clients.update(saved)
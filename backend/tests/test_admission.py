@@ -0,0 +1,234 @@
+import fakeredis
+import pytest
+
+import config
+import admission
+import redis_client
+
+GB = 1024 ** 3
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(config, "ADMISSION_MAX_QUEUE_DEPTH", 10)
+    monkeypatch.setattr(config, "ADMISSION_MAX_INFLIGHT_BYTES", 10 * GB)
+    monkeypatch.setattr(config, "ADMISSION_MAX_DEFERRED_DEPTH", 100)
+    monkeypatch.setattr(config, "ADMISSION_RESERVATION_TTL_SECONDS", 3600)
+    monkeypatch.setattr(config, "ADMISSION_DEFAULT_JOB_SECONDS", 60)
+    monkeypatch.setattr(config, "WORKER_CONCURRENCY", 1)
+    monkeypatch.setattr(config, "ADMISSION_DEFAULT_CLIENT_LIMITS", {
+        "max_queued": 5,
+        "max_inflight_bytes": 2 * GB,
+        "max_wait_seconds": 3600,
+        "overflow": "reject",
+    })
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "time", clock)
+    return clock
+
+
+def client_bytes(fake_redis, client_id):
+    return int(fake_redis.get(f"{admission._CLIENT_KEY_PREFIX}{client_id}:reserved_bytes") or 0)
+
+
+def test_admit_reserves_and_release_gives_back():
+    decision = admission.admit("t1", "a", 100)
+    assert decision.admitted and not decision.deferred
+    assert admission.snapshot()["queue_depth"] == 1
+    assert admission.snapshot()["inflight_bytes"] == 100
+
+    admission.release("t1")
+    admission.release("t1")
+    snapshot = admission.snapshot()
+    assert (snapshot["queue_depth"], snapshot["inflight_bytes"]) == (0, 0)
+
+
+def test_global_depth_limit_rejects_without_keeping_the_reservation(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_QUEUE_DEPTH", 2)
+    assert admission.admit("t1", "a").admitted
+    assert admission.admit("t2", "b").admitted
+    decision = admission.admit("t3", "c")
+    assert not decision.admitted
+    assert decision.retry_after_seconds >= 1
+    assert admission.snapshot()["queue_depth"] == 2
+
+
+def test_client_byte_limit_rejects(fake_redis):
+    assert admission.admit("t1", "a", GB).admitted
+    decision = admission.admit("t2", "a", 2 * GB)
+    assert not decision.admitted
+    assert "size" in decision.reason
+    assert client_bytes(fake_redis, "a") == GB
+    # Other clients are unaffected
+    assert admission.admit("t3", "b", GB).admitted
+
+
+def test_client_overflow_defers_to_low_priority(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"bulk": {"max_queued": 1, "overflow": "defer"}})
+    assert not admission.admit("t1", "bulk").deferred
+    decision = admission.admit("t2", "bulk")
+    assert decision.admitted and decision.deferred
+    assert decision.priority == config.ADMISSION_LOW_PRIORITY
+
+
+def test_deferred_tasks_do_not_count_toward_the_interactive_lane(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_QUEUE_DEPTH", 3)
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"bulk": {"max_queued": 1, "overflow": "defer"}})
+    decisions = [admission.admit(f"bulk{i}", "bulk") for i in range(10)]
+    assert [d.deferred for d in decisions] == [False] + [True] * 9
+    # Deferred tasks wait behind everything queued in both lanes
+    assert decisions[-1].estimated_wait_seconds == (1 + 8) * 60
+
+    snapshot = admission.snapshot()
+    assert (snapshot["queue_depth"], snapshot["deferred_depth"]) == (1, 9)
+    first = admission.admit("i1", "interactive")
+    second = admission.admit("i2", "interactive")
+    assert first.admitted and second.admitted
+    assert second.estimated_wait_seconds == 2 * 60
+    assert not admission.admit("i3", "interactive").admitted
+    # A full interactive lane does not turn away work bound for the low-priority lane
+    assert admission.admit("bulk10", "bulk").deferred
+
+
+def test_low_priority_lane_has_its_own_cap(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_DEFERRED_DEPTH", 2)
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"bulk": {"max_queued": 1, "overflow": "defer"}})
+    assert [admission.admit(f"t{i}", "bulk").deferred for i in range(3)] == [False, True, True]
+    decision = admission.admit("t3", "bulk")
+    assert not decision.admitted
+    assert "low-priority" in decision.reason
+    assert admission.snapshot()["deferred_depth"] == 2
+
+
+def test_client_returns_to_the_interactive_lane_once_its_share_drains(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"bulk": {"max_queued": 1, "overflow": "defer"}})
+    admission.admit("t0", "bulk")
+    assert admission.admit("t1", "bulk").deferred
+    admission.release("t0")
+    assert not admission.admit("t2", "bulk").deferred
+
+
+def test_deferred_reservations_are_released_and_expire_with_their_bytes(fake_redis, clock, monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"bulk": {"max_queued": 1, "overflow": "defer"}})
+    admission.admit("t0", "bulk", 100)
+    admission.admit("t1", "bulk", 100)
+    admission.add_bytes("t1", 50)
+    assert admission.snapshot()["inflight_bytes"] == 250
+    admission.release("t1")
+    assert admission.snapshot()["inflight_bytes"] == 100
+
+    admission.admit("t2", "bulk", 100)
+    clock.now += config.ADMISSION_RESERVATION_TTL_SECONDS + 1
+    snapshot = admission.snapshot()
+    assert (snapshot["queue_depth"], snapshot["deferred_depth"], snapshot["inflight_bytes"]) == (0, 0, 0)
+    assert client_bytes(fake_redis, "bulk") == 0
+
+
+def test_estimated_wait_over_client_limit_rejects_with_retry_after(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {"a": {"max_wait_seconds": 100}})
+    for i in range(3):
+        admission.admit(f"t{i}", f"other{i}")
+    decision = admission.admit("t3", "a")
+    # Three tasks ahead at the default 60s per job
+    assert not decision.admitted
+    assert decision.estimated_wait_seconds == 180
+    assert decision.retry_after_seconds == 80
+
+
+def test_add_bytes_grows_the_reservation_until_release(fake_redis):
+    admission.admit("t1", "a", 0)
+    admission.add_bytes("t1", 500)
+    assert admission.snapshot()["inflight_bytes"] == 500
+    assert client_bytes(fake_redis, "a") == 500
+    admission.release("t1")
+    assert admission.snapshot()["inflight_bytes"] == 0
+    assert client_bytes(fake_redis, "a") == 0
+    # A released task cannot grow a reservation it no longer holds
+    admission.add_bytes("t1", 500)
+    assert admission.snapshot()["inflight_bytes"] == 0
+
+
+def test_stale_reservations_expire_with_their_bytes(fake_redis, clock):
+    admission.admit("t1", "a", 100)
+    clock.now += config.ADMISSION_RESERVATION_TTL_SECONDS + 1
+    snapshot = admission.snapshot()
+    assert (snapshot["queue_depth"], snapshot["inflight_bytes"]) == (0, 0)
+    assert client_bytes(fake_redis, "a") == 0
+    assert fake_redis.zcard(f"{admission._CLIENT_KEY_PREFIX}a:reservations") == 0
+
+
+def test_cancel_does_not_feed_the_throughput_estimate(fake_redis, clock):
+    admission.admit("t1", "a")
+    admission.admit("t2", "a")
+    admission.release("t1")
+    clock.now += 10
+    admission.cancel("t2")
+    assert fake_redis.get(admission._SECONDS_PER_JOB_KEY) is None
+
+
+def test_completions_while_busy_update_the_throughput_estimate(fake_redis, clock):
+    for i in range(3):
+        admission.admit(f"t{i}", "a")
+    admission.release("t0")
+    clock.now += 10
+    admission.release("t1")
+    # 0.8 * 60 (default) + 0.2 * 10
+    assert float(fake_redis.get(admission._SECONDS_PER_JOB_KEY)) == pytest.approx(50)
+
+
+def test_idle_gap_does_not_inflate_the_throughput_estimate(fake_redis, clock):
+    fake_redis.set(admission._SECONDS_PER_JOB_KEY, 30)
+    admission.admit("t1", "a")
+    admission.release("t1")
+    clock.now += 12 * 3600
+    admission.admit("t2", "a")
+    clock.now += 30
+    admission.release("t2")
+    assert float(fake_redis.get(admission._SECONDS_PER_JOB_KEY)) == pytest.approx(30)
+
+
+def test_single_interval_is_clamped(fake_redis, clock):
+    fake_redis.set(admission._SECONDS_PER_JOB_KEY, 30)
+    admission.admit("t1", "a")
+    admission.admit("t2", "a")
+    admission.release("t1")
+    clock.now += 12 * 3600
+    admission.release("t2")
+    expected = 0.8 * 30 + 0.2 * admission._MAX_COMPLETION_INTERVAL_SECONDS
+    assert float(fake_redis.get(admission._SECONDS_PER_JOB_KEY)) == pytest.approx(expected)
+
+
+def test_fails_open_when_redis_is_down():
+    server = fakeredis.FakeServer()
+    server.connected = False
+    redis_client._clients[config.ADMISSION_REDIS_URL] = fakeredis.FakeRedis(server=server)
+    assert admission.admit("t1", "a").admitted
+    admission.release("t1")
+
+
+def test_disabled_admits_everything(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(config, "ADMISSION_ENABLED", False)
+    assert admission.admit("t1", "a").admitted
+
+
+def test_client_id_header_is_only_used_when_trusted(monkeypatch):
+    headers = {"x-client-id": "bulk"}
+    assert admission.client_id_for(headers, "10.0.0.1") == "bulk"
+    monkeypatch.setattr(config, "ADMISSION_TRUST_CLIENT_ID_HEADER", False)
+    assert admission.client_id_for(headers, "10.0.0.1") == "10.0.0.1"
+    assert admission.client_id_for({}, None) == "anonymous"
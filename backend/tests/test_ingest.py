@@ -0,0 +1,205 @@
+import json
+
+import requests
+
+import ingest
+
+
+class FakeSubmitter:
+    """Submitter that hands out task ids and answers wait() from a table of outcomes."""
+
+    def __init__(self, outcomes=None, wait_error=None, submit_error=None):
+        self.outcomes = outcomes or {}
+        self.wait_error = wait_error
+        self.submit_error = submit_error
+        self.submitted = []
+        self.waited = []
+
+    def submit(self, source):
+        if self.submit_error:
+            raise self.submit_error
+        task_id = f"task-{len(self.submitted)}"
+        self.submitted.append(source)
+        return task_id
+
+    def wait(self, task_id):
+        self.waited.append(task_id)
+        if self.wait_error:
+            raise self.wait_error
+        return self.outcomes.get(task_id, {"status": "SUCCESS", "result": {"action_segments": []}})
+
+
+def make_videos(tmp_path, count):
+    dataset = tmp_path / "dataset"
+    dataset.mkdir()
+    for i in range(count):
+        (dataset / f"ep{i}.mp4").write_bytes(f"video {i}".encode())
+    return dataset
+
+
+def run(tmp_path, source, submitter, **kwargs):
+    return ingest.run_ingest(
+        str(source),
+        str(tmp_path / "state.json"),
+        str(tmp_path / "results.json"),
+        submitter,
+        concurrency=2,
+        **kwargs
+    )
+
+
+def statuses(tmp_path):
+    state = ingest.IngestState(str(tmp_path / "state.json"))
+    state.close()
+    return sorted(item["status"] for item in state.items.values())
+
+
+def test_processes_every_video_and_skips_them_on_rerun(tmp_path):
+    dataset = make_videos(tmp_path, 3)
+    submitter = FakeSubmitter()
+    summary = run(tmp_path, dataset, submitter)
+    assert (summary["processed"], summary["failed"]) == (3, 0)
+    assert statuses(tmp_path) == ["done"] * 3
+
+    rerun = FakeSubmitter()
+    summary = run(tmp_path, dataset, rerun)
+    assert summary["skipped"] == 3
+    assert rerun.submitted == []
+
+
+def test_poll_errors_keep_the_task_submitted_and_resume_it(tmp_path):
+    dataset = make_videos(tmp_path, 3)
+    run(tmp_path, dataset, FakeSubmitter(wait_error=requests.ConnectionError("API restarting")))
+    state = ingest.IngestState(str(tmp_path / "state.json"))
+    assert [item["status"] for item in state.items.values()] == ["submitted"] * 3
+    assert all(item["poll_error"] == "API restarting" for item in state.items.values())
+    state.close()
+
+    resumed = FakeSubmitter()
+    summary = run(tmp_path, dataset, resumed)
+    assert resumed.submitted == []
+    assert sorted(resumed.waited) == ["task-0", "task-1", "task-2"]
+    assert summary["failed"] == 0
+    assert statuses(tmp_path) == ["done"] * 3
+
+
+def test_failed_tasks_and_submissions_are_failed(tmp_path):
+    dataset = make_videos(tmp_path, 1)
+    run(tmp_path, dataset, FakeSubmitter(outcomes={"task-0": {"status": "FAILURE", "error": "bad video"}}))
+    results = json.loads((tmp_path / "results.json").read_text())
+    assert (results[0]["status"], results[0]["error"]) == ("failed", "bad video")
+
+    run(tmp_path, dataset, FakeSubmitter(submit_error=requests.HTTPError("500")), retry_failed=True)
+    assert statuses(tmp_path) == ["failed"]
+
+    retried = FakeSubmitter()
+    run(tmp_path, dataset, retried, retry_failed=True)
+    assert len(retried.submitted) == 1
+    assert statuses(tmp_path) == ["done"]
+
+
+def test_missing_manifest_entries_fail_without_stopping_the_run(tmp_path):
+    dataset = make_videos(tmp_path, 1)
+    manifest = tmp_path / "list.txt"
+    manifest.write_text(f"{dataset / 'ep0.mp4'}\n{dataset / 'missing.mp4'}\n")
+    submitter = FakeSubmitter()
+    summary = run(tmp_path, manifest, submitter)
+    assert summary["unreadable"] == 1
+    assert [source["path"] for source in submitter.submitted] == [str(dataset / "ep0.mp4")]
+    results = {result["source"]: result for result in json.loads((tmp_path / "results.json").read_text())}
+    missing = results[str(dataset / "missing.mp4")]
+    assert missing["status"] == "failed"
+    assert "No such file" in missing["error"]
+
+
+def test_discover_walks_directories_for_videos(tmp_path):
+    dataset = make_videos(tmp_path, 2)
+    (dataset / "nested").mkdir()
+    (dataset / "nested" / "ep9.MOV").write_bytes(b"video")
+    (dataset / "notes.txt").write_text("not a video")
+    paths = [source["path"] for source in ingest.discover_sources(str(dataset))]
+    assert paths == sorted([str(dataset / "ep0.mp4"), str(dataset / "ep1.mp4"), str(dataset / "nested" / "ep9.MOV")])
+
+
+def test_discover_reads_csv_manifests(tmp_path):
+    manifest = tmp_path / "videos.csv"
+    manifest.write_text("id,URL\n1,https://example.com/a.mp4\n2,clips/b.mp4\n3,\n")
+    assert ingest.discover_sources(str(manifest)) == [
+        {"url": "https://example.com/a.mp4"},
+        {"path": str(tmp_path / "clips" / "b.mp4")},
+    ]
+
+
+def test_discover_reads_plain_lists(tmp_path):
+    manifest = tmp_path / "videos.txt"
+    manifest.write_text("# comment\nhttps://youtu.be/dQw4w9WgXcQ\n\n/data/a.mp4\n")
+    assert ingest.discover_sources(str(manifest)) == [
+        {"url": "https://youtu.be/dQw4w9WgXcQ"},
+        {"path": "/data/a.mp4"},
+    ]
+
+
+def test_state_replays_the_journal_after_a_crash(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = ingest.IngestState(path)
+    state.update("url:a", status="submitted", task_id="t1")
+    state.update("url:a", status="done")
+    state.update("url:b", status="pending")
+    # No save() or close(): the process died here
+
+    reloaded = ingest.IngestState(path)
+    assert reloaded.items["url:a"]["status"] == "done"
+    assert reloaded.items["url:a"]["task_id"] == "t1"
+    assert reloaded.items["url:b"]["status"] == "pending"
+    reloaded.close()
+
+
+def test_state_ignores_a_truncated_last_line(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = ingest.IngestState(path)
+    state.update("url:a", status="done")
+    state.close()
+    with open(f"{path}.journal", "a") as f:
+        f.write('{"key": "url:b", "fie')
+
+    reloaded = ingest.IngestState(path)
+    reloaded.update("url:c", status="pending")
+    reloaded.close()
+    assert set(ingest.IngestState(path).items) == {"url:a", "url:c"}
+
+
+def test_save_folds_the_journal_into_the_snapshot(tmp_path):
+    path = tmp_path / "state.json"
+    state = ingest.IngestState(str(path))
+    state.update("url:a", status="done")
+    state.key_for({"path": str(make_videos(tmp_path, 1) / "ep0.mp4")})
+    state.save()
+    state.close()
+    assert (tmp_path / "state.json.journal").read_text() == ""
+    snapshot = json.loads(path.read_text())
+    assert snapshot["items"]["url:a"]["status"] == "done"
+    assert len(snapshot["hashes"]) == 1
+
+
+def test_files_are_keyed_by_content(tmp_path):
+    dataset = make_videos(tmp_path, 2)
+    (dataset / "copy.mp4").write_bytes((dataset / "ep0.mp4").read_bytes())
+    state = ingest.IngestState(str(tmp_path / "state.json"))
+    keys = [state.key_for({"path": str(dataset / name)}) for name in ("ep0.mp4", "ep1.mp4", "copy.mp4")]
+    state.close()
+    assert keys[0] == keys[2] != keys[1]
+    assert keys[0].startswith("sha256:")
+
+
+def test_resumes_tasks_left_submitted_by_a_previous_run(tmp_path):
+    dataset = make_videos(tmp_path, 2)
+    state = ingest.IngestState(str(tmp_path / "state.json"))
+    running_key = state.key_for({"path": str(dataset / "ep0.mp4")})
+    state.update(running_key, status="submitted", task_id="earlier-task")
+    state.close()
+
+    submitter = FakeSubmitter()
+    summary = run(tmp_path, dataset, submitter)
+    assert summary["processed"] == 2
+    assert [source["path"] for source in submitter.submitted] == [str(dataset / "ep1.mp4")]
+    assert "earlier-task" in submitter.waited
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import admission
+import main
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(config, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(config, "ADMISSION_TRUST_CLIENT_ID_HEADER", True)
+    monkeypatch.setattr(config, "ADMISSION_DEFAULT_CLIENT_LIMITS", {
+        "max_queued": 5,
+        "max_inflight_bytes": 1000,
+        "max_wait_seconds": 3600,
+        "overflow": "reject",
+    })
+    monkeypatch.setattr(config, "ADMISSION_CLIENT_LIMITS", {})
+
+
+class FakePipeline:
+    def __init__(self, queued, error=None):
+        self.queued = queued
+        self.error = error
+
+    def apply_async(self, task_id, priority):
+        if self.error:
+            raise self.error
+        self.queued.append({"task_id": task_id, "priority": priority})
+        return SimpleNamespace(id=task_id)
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = []
+    monkeypatch.setattr(main, "build_segmentation_pipeline", lambda *args, **kwargs: FakePipeline(queued))
+    return queued
+
+
+def upload(size, content_type="video/mp4"):
+    return TestClient(main.app).post(
+        "/upload_video/",
+        files={"file": ("clip.mp4", b"0" * size, content_type)},
+        headers={"X-Client-Id": "tester", "Origin": "http://localhost:3000"},
+    )
+
+
+def test_admitted_upload_is_queued_and_keeps_its_reservation(queued, tmp_path):
+    response = upload(100)
+    assert response.status_code == 200
+    assert [q["task_id"] for q in queued] == [response.json()["task_id"]]
+    assert (tmp_path / f"{response.json()['task_id']}.mp4").exists()
+    assert admission.snapshot()["queue_depth"] == 1
+
+
+def test_oversized_upload_is_rejected_before_the_body_is_read(queued, tmp_path, monkeypatch):
+    # Only the endpoint's fallback for uploads without Content-Length measures the body
+    monkeypatch.setattr(main, "_upload_size", lambda file: pytest.fail("upload reached the endpoint"))
+    response = upload(5000)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Still the outermost middleware, so browsers can read the 429
+    assert response.headers["access-control-allow-origin"]
+    assert queued == []
+    assert list(tmp_path.iterdir()) == []
+    assert admission.snapshot()["queue_depth"] == 0
+
+
+def test_reservation_is_given_back_when_the_endpoint_refuses_the_upload(queued):
+    response = upload(100, content_type="text/plain")
+    assert response.status_code == 400
+    assert admission.snapshot()["queue_depth"] == 0
+
+
+def test_reservation_is_given_back_when_queueing_fails(monkeypatch):
+    monkeypatch.setattr(
+        main, "build_segmentation_pipeline", lambda *args, **kwargs: FakePipeline([], error=ConnectionError("broker down"))
+    )
+    response = upload(100)
+    assert response.status_code == 500
+    assert admission.snapshot()["queue_depth"] == 0
@@ -0,0 +1,71 @@
+import pytest
+
+import config
+import sampling
+
+
+@pytest.fixture(autouse=True)
+def no_default_budget(monkeypatch):
+    monkeypatch.setattr(config, "SAMPLING_DEFAULT_TOKEN_BUDGET", 0)
+    monkeypatch.setattr(config, "SAMPLING_MIN_FPS", 0.1)
+
+
+def test_without_budget_leaves_sampling_to_the_model_defaults():
+    chosen = sampling.choose_sampling({}, 60)
+    assert chosen["fps"] is None
+    assert chosen["media_resolution"] is None
+    assert chosen["estimated_prompt_tokens"] == sampling.estimate_prompt_tokens(60, 1.0, "medium")
+    assert chosen["budget_status"] is None
+
+
+def test_keeps_default_sampling_when_it_fits_the_budget():
+    chosen = sampling.choose_sampling({"token_budget": 100000}, 60)
+    assert (chosen["fps"], chosen["media_resolution"]) == (1.0, "medium")
+    assert chosen["budget_status"] == sampling.WITHIN_BUDGET
+
+
+def test_drops_resolution_before_frame_rate():
+    chosen = sampling.choose_sampling({"token_budget": 100000}, 600)
+    assert (chosen["fps"], chosen["media_resolution"]) == (1.0, "low")
+    assert chosen["estimated_prompt_tokens"] <= 100000
+
+
+def test_lowers_frame_rate_to_fit_the_budget():
+    chosen = sampling.choose_sampling({"token_budget": 30000}, 600)
+    assert chosen["media_resolution"] == "low"
+    assert 0.1 < chosen["fps"] < 1.0
+    assert chosen["estimated_prompt_tokens"] <= 30000
+    assert chosen["budget_status"] == sampling.WITHIN_BUDGET
+
+
+def test_reports_over_budget_at_the_frame_rate_floor():
+    chosen = sampling.choose_sampling({"token_budget": 10000}, 600)
+    assert (chosen["fps"], chosen["media_resolution"]) == (0.1, "low")
+    assert chosen["estimated_prompt_tokens"] == 24160
+    assert chosen["budget_status"] == sampling.OVER_BUDGET
+
+
+def test_explicit_settings_win_over_the_budget():
+    chosen = sampling.choose_sampling({"fps": 2.0, "media_resolution": "high", "token_budget": 10000}, 600)
+    assert (chosen["fps"], chosen["media_resolution"]) == (2.0, "high")
+    assert chosen["budget_status"] == sampling.OVER_BUDGET
+
+
+def test_explicit_resolution_only_sets_the_frame_rate_from_the_budget():
+    chosen = sampling.choose_sampling({"media_resolution": "medium", "token_budget": 30000}, 600)
+    assert chosen["media_resolution"] == "medium"
+    assert chosen["fps"] < 1.0
+
+
+def test_unknown_duration_does_not_claim_the_budget_was_applied():
+    chosen = sampling.choose_sampling({"token_budget": 10000}, None)
+    assert chosen["fps"] is None
+    assert chosen["estimated_prompt_tokens"] is None
+    assert chosen["budget_status"] == sampling.UNKNOWN_DURATION
+
+
+def test_default_budget_applies_when_the_task_sets_none(monkeypatch):
+    monkeypatch.setattr(config, "SAMPLING_DEFAULT_TOKEN_BUDGET", 10000)
+    chosen = sampling.choose_sampling(None, 600)
+    assert chosen["token_budget"] == 10000
+    assert chosen["media_resolution"] == "low"
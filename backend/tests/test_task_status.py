@@ -0,0 +1,85 @@
+import pytest
+
+import config
+import task_status
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    task_status._entries.clear()
+    task_status._celery_ids.clear()
+    monkeypatch.setattr(config, "STATUS_REFRESH_SECONDS", 5)
+
+
+class FakeBackend:
+    """Stand-in for the result backend: task_id -> (status, result), recording each batch read."""
+
+    def __init__(self):
+        self.states = {}
+        self.reads = []
+
+    def fetch(self, task_ids):
+        self.reads.append(list(task_ids))
+        return {task_id: task_status._entry(*self.states.get(task_id, ("PENDING", None))) for task_id in task_ids}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(task_status, "_fetch_from_backend", backend.fetch)
+    return backend
+
+
+def test_unknown_tasks_are_read_in_one_batch(backend):
+    backend.states["a"] = ("STARTED", None)
+    found = task_status.get_many(["a", "b", "a"])
+    assert backend.reads == [["a", "b"]]
+    assert found["a"]["status"] == "STARTED"
+    assert found["b"]["status"] == "PENDING"
+
+
+def test_terminal_states_are_never_read_again(backend):
+    backend.states["a"] = ("SUCCESS", {"segments": []})
+    task_status.get("a")
+    task_status._entries["a"]["checked_at"] = 0
+    assert task_status.get("a")["result"] == {"segments": []}
+    assert len(backend.reads) == 1
+
+
+def test_non_terminal_states_are_refreshed_once_stale(backend):
+    backend.states["a"] = ("STARTED", None)
+    task_status.get("a")
+    task_status.get("a")
+    assert len(backend.reads) == 1
+    task_status._entries["a"]["checked_at"] -= config.STATUS_REFRESH_SECONDS
+    backend.states["a"] = ("SUCCESS", {})
+    assert task_status.get("a")["status"] == "SUCCESS"
+    assert len(backend.reads) == 2
+
+
+def test_error_results_are_reported_as_failures(backend):
+    backend.states["a"] = ("SUCCESS", {"error": "Video file not found"})
+    entry = task_status.get("a")
+    assert entry["status"] == "FAILURE"
+    assert entry["error"] == "Video file not found"
+    assert entry["result"] is None
+
+
+def test_notification_during_a_read_is_not_overwritten(backend, monkeypatch):
+    def fetch_while_task_finishes(task_ids):
+        task_status._apply_event(b'{"task_id": "a", "status": "SUCCESS", "result": {"segments": []}}')
+        return backend.fetch(task_ids)
+
+    backend.states["a"] = ("STARTED", None)
+    monkeypatch.setattr(task_status, "_fetch_from_backend", fetch_while_task_finishes)
+    assert task_status.get("a")["status"] == "SUCCESS"
+
+
+def test_pending_read_does_not_regress_a_known_state(backend):
+    task_status._apply_event(b'{"task_id": "a", "status": "STARTED"}')
+    task_status._entries["a"]["checked_at"] -= config.STATUS_REFRESH_SECONDS
+    entry = task_status.get("a")
+    assert entry["status"] == "STARTED"
+    # Counts as checked, so the next poll is served from the cache
+    task_status.get("a")
+    assert len(backend.reads) == 1
@@ -0,0 +1,157 @@
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import celery
+import pytest
+import requests
+
+import config
+import tasks
+
+
+class Retry(Exception):
+    pass
+
+
+class FakeTask:
+    """Just enough of a bound Celery task for _run_stage and _route_remaining_stages."""
+
+    name = "tasks.fake_stage"
+    max_retries = 2
+
+    def __init__(self, retries=0, request_id=None, chain=None):
+        self.request = SimpleNamespace(
+            id=request_id or str(uuid.uuid4()),
+            retries=retries,
+            called_directly=False,
+            chain=chain,
+        )
+        self.retried_with = None
+
+    def retry(self, exc=None, countdown=None):
+        self.retried_with = countdown
+        return Retry()
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setattr(config, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(config, "STAGE_RETRY_BACKOFF_SECONDS", 10)
+    monkeypatch.setattr(config, "STAGE_MAX_DELIVERIES", 3)
+
+
+def job(**fields):
+    return dict(tasks.new_job("app-id", video_url="https://example.com/a.mp4"), **fields)
+
+
+def test_stage_runs_and_returns_its_job():
+    assert tasks._run_stage(FakeTask(), "fetch", job(), lambda j: dict(j, probe={"ok": True}))["probe"] == {"ok": True}
+
+
+def test_async_stages_are_awaited():
+    async def stage(j):
+        return dict(j, gemini_file_name="files/1")
+
+    assert tasks._run_stage(FakeTask(), "upload", job(), stage)["gemini_file_name"] == "files/1"
+
+
+@pytest.mark.parametrize("fields", [{"error": "earlier failure"}, {"result": {"action_segments": []}}])
+def test_stage_is_skipped_after_an_error_or_a_result(fields):
+    stage = mock.Mock()
+    assert tasks._run_stage(FakeTask(), "upload", job(**fields), stage) == job(**fields)
+    stage.assert_not_called()
+
+
+def test_missing_api_key_fails_the_job(monkeypatch):
+    monkeypatch.setattr(config, "GEMINI_API_KEY", None)
+    assert "GEMINI_API_KEY" in tasks._run_stage(FakeTask(), "fetch", job(), mock.Mock())["error"]
+
+
+def test_transient_errors_retry_the_stage_with_backoff():
+    task = FakeTask(retries=1)
+    with pytest.raises(Retry):
+        tasks._run_stage(task, "fetch", job(), mock.Mock(side_effect=requests.ConnectionError("reset")))
+    assert task.retried_with == 20
+
+
+def test_transient_errors_fail_the_job_once_retries_run_out():
+    task = FakeTask(retries=FakeTask.max_retries)
+    result = tasks._run_stage(task, "fetch", job(), mock.Mock(side_effect=requests.ConnectionError("reset")))
+    assert task.retried_with is None
+    assert result["error"] == "Error during fetch: reset"
+
+
+def test_other_errors_fail_the_job_without_retrying():
+    task = FakeTask()
+    result = tasks._run_stage(task, "preprocess", job(), mock.Mock(side_effect=ValueError("not a video")))
+    assert task.retried_with is None
+    assert result["error"] == "Error during preprocess: not a video"
+
+
+def test_stage_gives_up_after_too_many_deliveries():
+    stage = mock.Mock(side_effect=lambda j: j)
+    task = FakeTask(request_id="delivered-again")
+    for _ in range(config.STAGE_MAX_DELIVERIES):
+        assert tasks._run_stage(task, "generate", job(), stage).get("error") is None
+    result = tasks._run_stage(task, "generate", job(), stage)
+    assert "lost 3 times" in result["error"]
+    assert stage.call_count == config.STAGE_MAX_DELIVERIES
+    # A retry is a new attempt, not a redelivery
+    retried = FakeTask(request_id="delivered-again", retries=1)
+    assert tasks._run_stage(retried, "generate", job(), stage).get("error") is None
+
+
+def test_remaining_stages_are_routed_to_the_duration_class():
+    chain = [
+        {"task": "tasks.postprocess_result", "options": {"task_id": "app-id"}},
+        {"task": "tasks.generate_segments", "options": {}},
+        {"task": "tasks.upload_video_to_gemini"},
+    ]
+    tasks._route_remaining_stages(FakeTask(chain=chain), "long")
+    assert [stage["options"]["queue"] for stage in chain] == ["io.long", "inference.long", "upload.long"]
+    assert chain[0]["options"]["task_id"] == "app-id"
+
+
+def test_medium_stages_keep_their_base_queue():
+    chain = [{"task": "tasks.generate_segments", "options": {}}]
+    tasks._route_remaining_stages(FakeTask(chain=chain), "medium")
+    assert chain[0]["options"]["queue"] == "inference"
+
+
+def published_pipeline(**kwargs):
+    """Apply a pipeline without a broker; returns the app-facing result and the first message's options."""
+    sent = []
+
+    def send_task(self, name, args=None, kwargs=None, **options):
+        sent.append(dict(options, name=name))
+        return celery.result.AsyncResult(options["task_id"])
+
+    with mock.patch.object(celery.Celery, "send_task", send_task):
+        result = tasks.build_segmentation_pipeline("app-id", **kwargs).apply_async(task_id="app-id")
+    assert len(sent) == 1
+    return result, sent[0]
+
+
+def test_pipeline_result_is_stored_under_the_app_task_id():
+    result, first = published_pipeline(video_url="https://example.com/a.mp4")
+    assert result.id == "app-id"
+    assert first["name"] == "tasks.fetch_video"
+    remaining = first["chain"]
+    assert [stage["task"] for stage in remaining] == [
+        "tasks.postprocess_result",
+        "tasks.generate_segments",
+        "tasks.upload_video_to_gemini",
+        "tasks.preprocess_video",
+    ]
+    assert remaining[0]["options"]["task_id"] == "app-id"
+    assert first["task_id"] != "app-id"
+
+
+def test_uploads_are_queued_by_size_class(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULE_SHORT_MAX_SECONDS", 120)
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"0" * 1024)
+    _, first = published_pipeline(video_path=str(video))
+    assert first["queue"] == "io.short"
+    assert [stage["options"]["queue"] for stage in first["chain"]] == ["io.short", "inference.short", "upload.short", "io.short"]
@@ -0,0 +1,57 @@
+import config
+import url_cache
+
+
+def test_youtube_url_forms_share_a_key():
+    keys = {
+        url_cache.cache_key("https://www.youtube.com/watch?v=dQw4w9WgXcQ"),
+        url_cache.cache_key("https://youtu.be/dQw4w9WgXcQ"),
+        url_cache.cache_key("https://www.youtube.com/embed/dQw4w9WgXcQ"),
+    }
+    assert keys == {"youtube:dQw4w9WgXcQ"}
+
+
+def test_other_urls_are_keyed_by_url():
+    assert url_cache.cache_key("https://example.com/a.mp4") == "url:https://example.com/a.mp4"
+
+
+def test_settings_change_the_key_regardless_of_order():
+    url = "https://example.com/a.mp4"
+    low = url_cache.cache_key(url, {"model": "m", "fps": 0.5})
+    assert low == url_cache.cache_key(url, {"fps": 0.5, "model": "m"})
+    assert low != url_cache.cache_key(url, {"model": "m", "fps": 1.0})
+    assert low != url_cache.cache_key(url, {"model": "other", "fps": 0.5})
+    assert low.startswith("url:https://example.com/a.mp4:")
+
+
+def test_entries_are_stored_per_settings(monkeypatch):
+    monkeypatch.setattr(config, "URL_CACHE_ENABLED", True)
+    url = "https://example.com/a.mp4"
+    url_cache.put_entry(url, {"segments": []}, {"etag": '"v1"'}, settings={"fps": 1.0})
+    assert url_cache.get_entry(url, {"fps": 1.0})["result"] == {"segments": []}
+    assert url_cache.get_entry(url, {"fps": 0.5}) is None
+
+
+def test_304_is_unchanged():
+    assert url_cache.is_unchanged({"validators": {}}, 304, {})
+
+
+def test_200_with_matching_validators_is_unchanged():
+    entry = {"validators": {"etag": '"v1"', "content-length": "10"}}
+    assert url_cache.is_unchanged(entry, 200, {"etag": '"v1"', "content-length": "10"})
+
+
+def test_200_with_different_validators_is_changed():
+    entry = {"validators": {"etag": '"v1"', "content-length": "10"}}
+    assert not url_cache.is_unchanged(entry, 200, {"etag": '"v2"', "content-length": "10"})
+    assert not url_cache.is_unchanged(entry, 200, {"content-length": "10"})
+
+
+def test_content_length_alone_never_proves_unchanged():
+    entry = {"validators": {"content-length": "10"}}
+    assert not url_cache.is_unchanged(entry, 200, {"content-length": "10"})
+
+
+def test_errors_are_not_unchanged():
+    entry = {"validators": {"etag": '"v1"'}}
+    assert not url_cache.is_unchanged(entry, 404, {"etag": '"v1"'})
@@ -0,0 +1,93 @@
+from unittest import mock
+
+import pytest
+
+import config
+import video_probe
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "SCHEDULE_SHORT_MAX_SECONDS", 120)
+    monkeypatch.setattr(config, "SCHEDULE_MEDIUM_MAX_SECONDS", 900)
+    monkeypatch.setattr(config, "PROBE_FALLBACK_BYTES_PER_SECOND", 1000)
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (1, "short"),
+    (120, "short"),
+    (120.5, "medium"),
+    (900, "medium"),
+    (901, "long"),
+])
+def test_duration_class_boundaries(seconds, expected):
+    assert video_probe.duration_class({"duration_seconds": seconds}) == expected
+
+
+def test_unprobed_videos_are_medium():
+    assert video_probe.duration_class(None) == "medium"
+
+
+def test_duration_is_estimated_from_size_without_ffprobe():
+    assert video_probe.duration_class({"duration_seconds": None, "size_bytes": 100 * 1000}) == "short"
+    assert video_probe.duration_class({"duration_seconds": None, "size_bytes": 1000 * 1000}) == "long"
+
+
+@pytest.mark.parametrize("size_bytes, expected", [
+    (120 * 1000, "short"),
+    (120 * 1000 + 1, "medium"),
+    (900 * 1000, "medium"),
+    (900 * 1000 + 1, "long"),
+])
+def test_size_class_boundaries(size_bytes, expected):
+    assert video_probe.size_class(size_bytes) == expected
+
+
+def test_queue_for_suffixes_all_but_medium():
+    assert video_probe.queue_for("inference", "short") == "inference.short"
+    assert video_probe.queue_for("inference", "medium") == "inference"
+    assert video_probe.queue_for("io", "long") == "io.long"
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(b"0" * 2048)
+    return str(path)
+
+
+def test_probe_is_cached_by_content(video, tmp_path):
+    ffprobe = mock.Mock(return_value={"duration_seconds": 42.0, "width": 640, "height": 480, "codec": "h264"})
+    with mock.patch.object(video_probe, "_run_ffprobe", ffprobe):
+        first = video_probe.probe_video(video)
+        renamed = tmp_path / "renamed.mp4"
+        renamed.write_bytes(b"0" * 2048)
+        second = video_probe.probe_video(str(renamed))
+    assert ffprobe.call_count == 1
+    assert first == second
+    assert first["duration_seconds"] == 42.0
+    assert first["size_bytes"] == 2048
+
+
+def test_different_content_is_probed_again(video, tmp_path):
+    ffprobe = mock.Mock(return_value={"duration_seconds": 42.0})
+    other = tmp_path / "other.mp4"
+    other.write_bytes(b"1" * 2048)
+    with mock.patch.object(video_probe, "_run_ffprobe", ffprobe):
+        video_probe.probe_video(video)
+        video_probe.probe_video(str(other))
+    assert ffprobe.call_count == 2
+
+
+def test_size_only_fallbacks_are_not_cached(video):
+    ffprobe = mock.Mock(return_value={})
+    with mock.patch.object(video_probe, "_run_ffprobe", ffprobe):
+        probe = video_probe.probe_video(video)
+        video_probe.probe_video(video)
+    assert probe["duration_seconds"] is None
+    assert ffprobe.call_count == 2
+
+
+def test_missing_ffprobe_falls_back_to_size(video, monkeypatch):
+    monkeypatch.setattr(config, "FFPROBE_BINARY", "ffprobe-that-does-not-exist")
+    assert video_probe._run_ffprobe(video) == {}
@@ -0,0 +1,125 @@
+import re
+import json
+import time
+import hashlib
+from typing import Dict, Any, Optional
+
+import redis
+
+import config
+from redis_client import get_redis
+
+_ENTRY_KEY = "roboseg:urlcache:{key}"
+
+# Response headers used to tell whether a remote object changed since it was cached
+VALIDATOR_HEADERS = ("etag", "last-modified", "content-length")
+
+
+def is_youtube_url(url):
+    if not url:
+        return False
+    youtube_regex = (
+        r'(https?://)?(www\.)?'
+        '(youtube|youtu|youtube-nocookie)\.(com|be)/'
+        '(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
+    return re.match(youtube_regex, url)
+
+
+def youtube_video_id(url: str) -> Optional[str]:
+    """Return the 11-character video id of a YouTube URL, or None if it is not one."""
+    match = is_youtube_url(url)
+    if not match:
+        return None
+    video_id = match.group(6)
+    # Path forms the pattern does not know about (e.g. /shorts/) would capture part of the path
+    return None if "/" in video_id else video_id
+
+
+def cache_key(url: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Cache key for a source URL and the settings its result was computed with.
+
+    YouTube URLs are keyed by video id so that watch, embed and short-link forms of
+    the same video share one entry; any other URL is keyed by the URL itself. A digest
+    of `settings` (model, requested sampling) is appended, so a result is only reused
+    for requests that would have produced it.
+    """
+    video_id = youtube_video_id(url)
+    key = f"youtube:{video_id}" if video_id else f"url:{url}"
+    if settings:
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+        key = f"{key}:{digest}"
+    return key
+
+
+def get_entry(url: str, settings: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Return the cached entry for a URL and settings, or None on a miss or if the cache is unavailable."""
+    if not config.URL_CACHE_ENABLED:
+        return None
+    try:
+        raw = get_redis(config.URL_CACHE_REDIS_URL).get(_ENTRY_KEY.format(key=cache_key(url, settings)))
+    except redis.RedisError as e:
+        print(f"Warning: URL cache unavailable for {url}: {str(e)}")
+        return None
+    return json.loads(raw) if raw else None
+
+
+def put_entry(
+    url: str,
+    result: Dict[str, Any],
+    validators: Optional[Dict[str, str]] = None,
+    settings: Optional[Dict[str, Any]] = None
+) -> None:
+    """Store the segmentation result for a URL and settings together with the remote validators it was computed from."""
+    if not config.URL_CACHE_ENABLED:
+        return
+    entry = {
+        "url": url,
+        "settings": settings or {},
+        "validators": validators or {},
+        "result": result,
+        "cached_at": time.time(),
+    }
+    try:
+        get_redis(config.URL_CACHE_REDIS_URL).set(
+            _ENTRY_KEY.format(key=cache_key(url, settings)),
+            json.dumps(entry),
+            ex=config.URL_CACHE_TTL_SECONDS
+        )
+    except redis.RedisError as e:
+        print(f"Warning: failed to store URL cache entry for {url}: {str(e)}")
+
+
+def validators_from_headers(headers) -> Dict[str, str]:
+    """Pick the validator headers out of an HTTP response's headers."""
+    return {name: headers[name] for name in VALIDATOR_HEADERS if headers.get(name)}
+
+
+def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Request headers that make the origin answer 304 if the object is unchanged."""
+    headers = {}
+    if not entry:
+        return headers
+    validators = entry.get("validators", {})
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last-modified"):
+        headers["If-Modified-Since"] = validators["last-modified"]
+    return headers
+
+
+def is_unchanged(entry: Dict[str, Any], status_code: int, headers) -> bool:
+    """
+    Decide from a revalidation response whether the cached entry is still current.
+
+    A 304 is authoritative. Origins that ignore conditional requests answer 200, in
+    which case the object is unchanged only if every validator we stored still matches.
+    Entries without an ETag or Last-Modified can never be revalidated this way.
+    """
+    if status_code == 304:
+        return True
+    stored = entry.get("validators", {})
+    # Content-Length alone is too weak to prove the object is the same
+    if status_code != 200 or not (stored.get("etag") or stored.get("last-modified")):
+        return False
+    return validators_from_headers(headers) == stored
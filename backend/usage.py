@@ -0,0 +1,66 @@
+import time
+from typing import Dict, Any, List, Optional
+
+import redis
+
+import config
+from redis_client import get_redis
+
+# One hash per UTC day; fields are "<client_id>:<counter>"
+_DAY_KEY = "roboseg:usage:{day}"
+_COUNTERS = ("tasks", "prompt_tokens", "response_tokens", "total_tokens")
+_RETENTION_SECONDS = 400 * 24 * 3600
+
+
+def _day(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+def token_counts(usage_metadata) -> Dict[str, int]:
+    """Prompt/response/total token counts from a Gemini response's usage_metadata."""
+    if usage_metadata is None:
+        return {"prompt_token_count": 0, "response_token_count": 0, "total_token_count": 0}
+    prompt = usage_metadata.prompt_token_count or 0
+    response = usage_metadata.candidates_token_count or 0
+    return {
+        "prompt_token_count": prompt,
+        "response_token_count": response,
+        "total_token_count": usage_metadata.total_token_count or (prompt + response),
+    }
+
+
+def record(client_id: Optional[str], counts: Dict[str, int]) -> None:
+    """Add one task's token counts to today's totals for the client."""
+    client_id = client_id or "anonymous"
+    key = _DAY_KEY.format(day=_day(time.time()))
+    try:
+        pipe = get_redis(config.USAGE_REDIS_URL).pipeline()
+        pipe.hincrby(key, f"{client_id}:tasks", 1)
+        pipe.hincrby(key, f"{client_id}:prompt_tokens", counts["prompt_token_count"])
+        pipe.hincrby(key, f"{client_id}:response_tokens", counts["response_token_count"])
+        pipe.hincrby(key, f"{client_id}:total_tokens", counts["total_token_count"])
+        pipe.expire(key, _RETENTION_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Warning: failed to record token usage for client {client_id}: {str(e)}")
+
+
+def summary(days: int = 7, client_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Per-day, per-client token totals for the last `days` days (today included), newest first."""
+    now = time.time()
+    day_names = [_day(now - i * 24 * 3600) for i in range(days)]
+    pipe = get_redis(config.USAGE_REDIS_URL).pipeline()
+    for day in day_names:
+        pipe.hgetall(_DAY_KEY.format(day=day))
+
+    rows = []
+    for day, fields in zip(day_names, pipe.execute()):
+        per_client: Dict[str, Dict[str, Any]] = {}
+        for field, value in fields.items():
+            client, counter = field.decode().rsplit(":", 1)
+            if client_id and client != client_id:
+                continue
+            row = per_client.setdefault(client, {"day": day, "client_id": client, **{c: 0 for c in _COUNTERS}})
+            row[counter] = int(value)
+        rows.extend(sorted(per_client.values(), key=lambda r: r["client_id"]))
+    return rows
@@ -0,0 +1,111 @@
+import os
+import json
+import subprocess
+from typing import Dict, Any, Optional
+
+import redis
+
+import config
+from file_hash import file_sha256
+from redis_client import get_redis
+
+_PROBE_KEY = "roboseg:probe:{content_hash}"
+
+# Duration classes used to pick the queue of the later pipeline stages
+SHORT = "short"
+MEDIUM = "medium"
+LONG = "long"
+
+
+def _run_ffprobe(path: str) -> Dict[str, Any]:
+    """Read duration, resolution and codec with ffprobe. Returns {} if ffprobe is unavailable or fails."""
+    try:
+        completed = subprocess.run(
+            [config.FFPROBE_BINARY, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+            capture_output=True,
+            timeout=60,
+            check=True
+        )
+    except FileNotFoundError:
+        print(f"Warning: {config.FFPROBE_BINARY} not found, video duration will be estimated from file size")
+        return {}
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        print(f"Warning: ffprobe failed for {path}: {str(e)}")
+        return {}
+
+    data = json.loads(completed.stdout or b"{}")
+    video_stream = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), {})
+    duration = data.get("format", {}).get("duration") or video_stream.get("duration")
+    return {
+        "duration_seconds": float(duration) if duration else None,
+        "width": video_stream.get("width"),
+        "height": video_stream.get("height"),
+        "codec": video_stream.get("codec_name"),
+    }
+
+
+def probe_video(path: str) -> Dict[str, Any]:
+    """
+    Probe a video file for duration, resolution, codec and size.
+
+    Results are cached in Redis by content hash, so the same video submitted again
+    (or under another name) is never probed twice.
+    """
+    content_hash = file_sha256(path)
+    key = _PROBE_KEY.format(content_hash=content_hash)
+    try:
+        cached = get_redis(config.PROBE_CACHE_REDIS_URL).get(key)
+        if cached:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        print(f"Warning: probe cache unavailable: {str(e)}")
+
+    probe = {
+        "content_hash": content_hash,
+        "size_bytes": os.path.getsize(path),
+        "duration_seconds": None,
+        "width": None,
+        "height": None,
+        "codec": None,
+    }
+    probe.update(_run_ffprobe(path))
+
+    # Size-only fallbacks are not cached, so the file is probed properly once ffprobe works
+    if probe["duration_seconds"] is not None:
+        try:
+            get_redis(config.PROBE_CACHE_REDIS_URL).set(key, json.dumps(probe), ex=config.PROBE_CACHE_TTL_SECONDS)
+        except redis.RedisError as e:
+            print(f"Warning: failed to cache probe for {path}: {str(e)}")
+    return probe
+
+
+def expected_duration_seconds(probe: Dict[str, Any]) -> float:
+    """Probed duration, or an estimate from file size when ffprobe could not read it."""
+    if probe.get("duration_seconds"):
+        return probe["duration_seconds"]
+    return probe.get("size_bytes", 0) / config.PROBE_FALLBACK_BYTES_PER_SECOND
+
+
+def duration_class(probe: Optional[Dict[str, Any]]) -> str:
+    """Classify a probed video as short, medium or long by its expected duration."""
+    if not probe:
+        return MEDIUM
+    seconds = expected_duration_seconds(probe)
+    if seconds <= config.SCHEDULE_SHORT_MAX_SECONDS:
+        return SHORT
+    if seconds > config.SCHEDULE_MEDIUM_MAX_SECONDS:
+        return LONG
+    return MEDIUM
+
+
+def size_class(size_bytes: int) -> str:
+    """Duration class estimated from file size alone, for routing stages that run before the probe."""
+    return duration_class({"size_bytes": size_bytes})
+
+
+def queue_for(base_queue: str, video_class: str) -> str:
+    """Queue of a pipeline stage for a duration class: medium jobs use the base queue, others a suffixed one."""
+    if video_class == MEDIUM:
+        return base_queue
+    return f"{base_queue}.{video_class}"
+
@@ -20,10 +20,15 @@ if not exist venv\Scripts\activate (
 call venv\Scripts\activate
 set "PYTHONPATH=%PROJECT_ROOT%"
 
-REM Celery worker  (Windows needs --pool=solo)
-start "" /b "%PROJECT_ROOT%\venv\Scripts\python.exe" ^
-        -m celery -A celery_app worker --loglevel=info --pool=solo ^
-        > "%PROJECT_ROOT%backend\celery_output.log" 2>&1
+REM Celery workers, one per pipeline queue  (Windows needs --pool=solo)
+REM io prefetches 4 messages per process, upload and inference 1
+for %%Q in (io upload inference) do (
+    set "PREFETCH=1"
+    if "%%Q"=="io" set "PREFETCH=4"
+    start "" /b "%PROJECT_ROOT%\venv\Scripts\python.exe" ^
+            -m celery -A celery_app worker --loglevel=info --pool=solo -Q %%Q.short,%%Q,%%Q.long --prefetch-multiplier !PREFETCH! -n %%Q@%%COMPUTERNAME%% ^
+            > "%PROJECT_ROOT%backend\celery_%%Q_output.log" 2>&1
+)
 
 REM FastAPI
 start "" /b "%PROJECT_ROOT%\venv\Scripts\python.exe" ^
@@ -41,7 +46,9 @@ popd
 
 echo.
 echo All services are up.  Logs:
-echo   backend\celery_output.log
+echo   backend\celery_io_output.log
+echo   backend\celery_upload_output.log
+echo   backend\celery_inference_output.log
 echo   backend\api_output.log
 echo   frontend_output.log
 echo.
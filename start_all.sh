@@ -50,10 +50,16 @@ pip install -r requirements.txt
 echo "Installing missing packages..."
 pip install grpcio protobuf
 
-# Start Celery worker - fix module path
-echo "Starting Celery worker..."
-PYTHONIOENCODING=utf-8 celery -A celery_app worker --loglevel=info > celery_output.log 2>&1 &
-CELERY_PID=$!
+# Start one Celery worker per pipeline queue; pool sizes come from WORKER_POOLS in config.py.
+# io stages are short, so that worker prefetches more; upload and inference take one message per process
+# The io worker also drains the legacy "celery" queue
+echo "Starting Celery workers..."
+PYTHONIOENCODING=utf-8 celery -A celery_app worker --loglevel=info -Q io.short,io,io.long,celery --prefetch-multiplier 4 -n io@%h > celery_io_output.log 2>&1 &
+CELERY_IO_PID=$!
+PYTHONIOENCODING=utf-8 celery -A celery_app worker --loglevel=info -Q upload.short,upload,upload.long --prefetch-multiplier 1 -n upload@%h > celery_upload_output.log 2>&1 &
+CELERY_UPLOAD_PID=$!
+PYTHONIOENCODING=utf-8 celery -A celery_app worker --loglevel=info -Q inference.short,inference,inference.long --prefetch-multiplier 1 -n inference@%h > celery_inference_output.log 2>&1 &
+CELERY_INFERENCE_PID=$!
 
 # Start FastAPI server
 echo "Starting FastAPI server..."
@@ -73,7 +79,9 @@ echo "Frontend available at: http://localhost:5173"
 echo "Backend API available at: http://localhost:8000/docs"
 echo ""
 echo "Service outputs are being logged to:"
-echo "- backend/celery_output.log"
+echo "- backend/celery_io_output.log"
+echo "- backend/celery_upload_output.log"
+echo "- backend/celery_inference_output.log"
 echo "- backend/api_output.log"
 echo "- frontend_output.log"
 echo ""
@@ -84,7 +92,7 @@ function cleanup {
     echo "Stopping services..."
     kill $FRONTEND_PID
     kill $API_PID
-    kill $CELERY_PID
+    kill $CELERY_IO_PID $CELERY_UPLOAD_PID $CELERY_INFERENCE_PID
     
     # Only stop Redis if we started it
     if [ ! "$(nc -z localhost 6379 &>/dev/null && docker ps | grep -q roboseg-redis)" ]; then
@@ -97,4 +105,4 @@ function cleanup {
 trap cleanup SIGINT
 
 # Display logs in real-time (tail the log files)
-tail -f backend/celery_output.log backend/api_output.log frontend_output.log 
\ No newline at end of file
+tail -f backend/celery_io_output.log backend/celery_upload_output.log backend/celery_inference_output.log backend/api_output.log frontend_output.log 
\ No newline at end of file